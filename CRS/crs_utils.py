@@ -6,23 +6,55 @@ Purpose: Extract CRS and EPSG information from Sentinel-2 .SAFE directories
 """
 
 import os
+from functools import lru_cache
+from pathlib import Path
+
 import rasterio
+from rasterio.crs import CRS
 
+@lru_cache(maxsize=128)
 def find_band_path(safe_path, band_name="B03_10m"):
+    """
+    Return the path of the first .jp2 in a SAFE folder whose name contains
+    band_name. Cached, since the same SAFE is looked up several times.
+    """
+    band_path = next(Path(safe_path).rglob(f"*{band_name}*.jp2"), None)
+    if band_path is None:
+        raise FileNotFoundError(f"{band_name} not found in {safe_path}")
+    return str(band_path)
+
+def find_band_paths(safe_path, band_names=("B03_10m", "B08_10m")):
+    """
+    Locate several bands with a single walk of the SAFE folder.
+    Returns {band_name: path}.
+    """
+    found = {}
     for root, dirs, files in os.walk(safe_path):
         for file in files:
-            if band_name in file and file.endswith(".jp2"):
-                return os.path.join(root, file)
-    raise FileNotFoundError(f"{band_name} not found in {safe_path}")
+            if not file.endswith(".jp2"):
+                continue
+            for band_name in band_names:
+                if band_name not in found and band_name in file:
+                    found[band_name] = os.path.join(root, file)
+        if len(found) == len(band_names):
+            return found
+    missing = [b for b in band_names if b not in found]
+    raise FileNotFoundError(f"{', '.join(missing)} not found in {safe_path}")
+
+@lru_cache(maxsize=256)
+def _read_band_crs(band_path):
+    """Open a JP2 once for its CRS; cached as (wkt, epsg) so the result stays immutable."""
+    with rasterio.Env(GDAL_DISABLE_READDIR_ON_OPEN="EMPTY_DIR"), \
+            rasterio.open(band_path, sharing=False) as src:
+        return src.crs.to_wkt(), src.crs.to_epsg()
 
 def get_safe_crs(safe_path, band_name="B03_10m"):
     """
     Extract CRS and EPSG code from a Sentinel-2 SAFE folder.
     """
     band_path = find_band_path(safe_path, band_name)
-    with rasterio.open(band_path) as src:
-        crs = src.crs
-    return crs, crs.to_epsg()
+    wkt, epsg = _read_band_crs(band_path)
+    return CRS.from_wkt(wkt), epsg
 
 def get_dem_crs(dem_path):
     """
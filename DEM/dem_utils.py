@@ -6,10 +6,21 @@ Purpose: Load DEMs, reproject them to match Sentinel-2 grids, and optionally
 """
 
 import os
+import math
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
+
 import numpy as np
 import rasterio
-from rasterio.warp import reproject, Resampling
-from rasterio.windows import from_bounds
+from rasterio.warp import reproject, transform_bounds, Resampling
+from rasterio.windows import Window, from_bounds, bounds as window_bounds, transform as window_transform
+
+from Geometry import geometry_utils
+
+# leave one core free for the rest of the pipeline
+DEFAULT_NUM_THREADS = max(1, (os.cpu_count() or 1) - 1)
+OVERVIEW_FACTORS = (2, 4, 8, 16)
 
 def load_dem(dem_path):
     """
@@ -20,20 +31,64 @@ def load_dem(dem_path):
         dem_profile = src.profile
     return dem_data, dem_profile
 
+def add_overviews(dst, factors=OVERVIEW_FACTORS, resampling=Resampling.average):
+    """
+    Build internal overviews on an open (writable) dataset and record the
+    resampling method, so the GeoTIFF behaves like a COG for windowed reads.
+    """
+    dst.build_overviews(list(factors), resampling)
+    dst.update_tags(ns="rio_overview", resampling=resampling.name)
+
+def generate_tiling_grid(height, width, block_size=512):
+    """
+    Split a (height, width) grid into block_size x block_size windows.
+    Edge windows are clipped to the grid.
+    """
+    return [
+        Window(col, row, min(block_size, width - col), min(block_size, height - row))
+        for row in range(0, height, block_size)
+        for col in range(0, width, block_size)
+    ]
+
+def source_window_for_bounds(src, dst_bounds, dst_crs, pad=8):
+    """
+    Window of `src` covering dst_bounds (given in dst_crs), padded by `pad`
+    pixels so the resampling kernel has neighbours at block edges.
+    Returns None if the bounds fall outside the source raster.
+    """
+    left, bottom, right, top = transform_bounds(dst_crs, src.crs, *dst_bounds, densify_pts=21)
+    win = from_bounds(left, bottom, right, top, transform=src.transform)
+    col0 = max(0, math.floor(win.col_off) - pad)
+    row0 = max(0, math.floor(win.row_off) - pad)
+    col1 = min(src.width, math.ceil(win.col_off + win.width) + pad)
+    row1 = min(src.height, math.ceil(win.row_off + win.height) + pad)
+    if col1 <= col0 or row1 <= row0:
+        return None
+    return Window(col0, row0, col1 - col0, row1 - row0)
+
 def reproject_dem_to_match_profile(dem_path, target_profile, out_path=None, resampling=Resampling.bilinear,
-                                   src_nodata=None, dst_nodata=-9999):
+                                   src_nodata=None, dst_nodata=-9999,
+                                   num_threads=DEFAULT_NUM_THREADS, warp_mem_limit=512,
+                                   block_size=512, pad=8, dem_dataset=None):
     """
     Reprojects the DEM to match the CRS, transform, width, height of a reference profile.
-    If out_path is provided, writes GeoTIFF and returns (array, profile).
+    Pass an already-open dem_dataset to skip re-opening dem_path (it is left open).
+    If out_path is provided, writes a tiled GeoTIFF block by block and returns (None, profile).
     Otherwise, returns (array, profile) in memory.
 
+    The warp runs per destination block: each block reads only the source
+    window it needs (padded by `pad` pixels) and blocks are dispatched to a
+    pool of num_threads threads (GDAL releases the GIL while warping), so the
+    full DEM is never held in memory.
+
     Note:
     - We pass src_nodata and dst_nodata explicitly so resampling respects empties.
     - target_profile must contain: crs, transform, width, height
+    - warp_mem_limit (MB) is handed to the GDAL warper for each block.
     """
-    with rasterio.open(dem_path) as src:
-        src_data = src.read(1)
-        src_transform = src.transform
+    dem_ctx = nullcontext(dem_dataset) if dem_dataset is not None else rasterio.open(dem_path)
+    with rasterio.Env(GDAL_CACHEMAX=512, GDAL_NUM_THREADS=str(num_threads),
+                      CHECK_WITH_INVERT_PROJ=False), dem_ctx as src:
         src_crs = src.crs
         if src_nodata is None:
             src_nodata = src.nodata
@@ -43,20 +98,6 @@ def reproject_dem_to_match_profile(dem_path, target_profile, out_path=None, resa
         dst_width = target_profile["width"]
         dst_height = target_profile["height"]
 
-        dst_data = np.full((dst_height, dst_width), dst_nodata, dtype=np.float32)
-
-        reproject(
-            source=src_data,
-            destination=dst_data,
-            src_transform=src_transform,
-            src_crs=src_crs,
-            dst_transform=dst_transform,
-            dst_crs=dst_crs,
-            src_nodata=src_nodata,
-            dst_nodata=dst_nodata,
-            resampling=resampling
-        )
-
         out_profile = {
             "driver": "GTiff",
             "dtype": "float32",
@@ -66,48 +107,145 @@ def reproject_dem_to_match_profile(dem_path, target_profile, out_path=None, resa
             "width": dst_width,
             "height": dst_height,
             "nodata": dst_nodata,
+            "tiled": True,
+            "blockxsize": block_size,
+            "blockysize": block_size,
             "compress": "deflate",
-            "predictor": 2
+            "predictor": 2,
+            "BIGTIFF": "IF_SAFER"
         }
 
+        # DEM footprint in the destination CRS: blocks outside it have no
+        # input coverage and are filled with nodata without warping
+        src_footprint = geometry_utils.transform_bounds_to_match_crs(src.bounds, src_crs, dst_crs)
+
+        # source windows are worked out up front, on this thread
+        jobs = []
+        empty = []
+        for win in generate_tiling_grid(dst_height, dst_width, block_size):
+            dst_bounds = window_bounds(win, dst_transform)
+            if not geometry_utils.bounds_overlap(dst_bounds, src_footprint):
+                empty.append(win)
+                continue
+            jobs.append((win, source_window_for_bounds(src, dst_bounds, dst_crs, pad)))
+        print(f"🧱 DEM reprojection: {len(jobs)} blocks to warp, {len(empty)} empty blocks skipped")
+
+        read_lock = threading.Lock()
+
+        def warp_block(win, src_win):
+            block = np.full((win.height, win.width), dst_nodata, dtype=np.float32)
+            if src_win is None:
+                return win, block
+            with read_lock:  # dataset handles are not thread-safe
+                src_block = src.read(1, window=src_win)
+            reproject(
+                source=src_block,
+                destination=block,
+                src_transform=src.window_transform(src_win),
+                src_crs=src_crs,
+                dst_transform=window_transform(win, dst_transform),
+                dst_crs=dst_crs,
+                src_nodata=src_nodata,
+                dst_nodata=dst_nodata,
+                resampling=resampling,
+                num_threads=1,
+                warp_mem_limit=warp_mem_limit
+            )
+            return win, block
+
+        dst_data = None
+        dst = None
         if out_path:
             os.makedirs(os.path.dirname(out_path), exist_ok=True)
-            with rasterio.open(out_path, "w", **out_profile) as dst:
-                dst.write(dst_data, 1)
+            dst = rasterio.open(out_path, "w", **out_profile)
+        else:
+            dst_data = np.full((dst_height, dst_width), dst_nodata, dtype=np.float32)
+
+        def store(win, block):
+            if dst is not None:
+                dst.write(block, 1, window=win)
+            else:
+                dst_data[win.toslices()] = block
+
+        try:
+            if dst is not None:
+                for win in empty:
+                    dst.write(np.full((win.height, win.width), dst_nodata, dtype=np.float32), 1, window=win)
+
+            with ThreadPoolExecutor(max_workers=num_threads) as pool:
+                # keep only a few blocks in flight so memory stays bounded
+                pending = set()
+                for win, src_win in jobs:
+                    pending.add(pool.submit(warp_block, win, src_win))
+                    if len(pending) >= 2 * num_threads:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for fut in done:
+                            store(*fut.result())
+                for fut in as_completed(pending):
+                    store(*fut.result())
+
+            if dst is not None:
+                add_overviews(dst)
+        finally:
+            if dst is not None:
+                dst.close()
 
     return dst_data, out_profile
 
-def clip_to_ref_bounds(src_path, ref_path, out_path):
+def read_block_aligned(src, win):
     """
-    Clip src (already in ref CRS/grid) to the ref raster's bounds, writing a GeoTIFF.
-    Useful when src was reprojected to ref CRS but not exactly the same extent.
+    Read `win` from src by expanding it outwards to the dataset's internal
+    block boundaries (so every block is decompressed whole, once) and then
+    slicing the requested region back out. Returns (count, rows, cols).
     """
-    with rasterio.open(ref_path) as ref:
-        rb = ref.bounds
-        rcrs = ref.crs
+    by, bx = src.block_shapes[0]
+    col_off, row_off = max(0, int(win.col_off)), max(0, int(win.row_off))
+    width = int(win.col_off + win.width) - col_off
+    height = int(win.row_off + win.height) - row_off
 
-    with rasterio.open(src_path) as src:
-        assert str(src.crs) == str(rcrs), "Clip requires src already in reference CRS."
-        win = from_bounds(*rb, transform=src.transform).round_offsets().round_lengths()
-        data = src.read(window=win)
-        out_transform = src.window_transform(win)
-        profile = src.profile.copy()
-        profile.update({"height": data.shape[1], "width": data.shape[2], "transform": out_transform})
+    col0 = (col_off // bx) * bx
+    row0 = (row_off // by) * by
+    col1 = min(src.width, math.ceil((col_off + width) / bx) * bx)
+    row1 = min(src.height, math.ceil((row_off + height) / by) * by)
 
-        os.makedirs(os.path.dirname(out_path), exist_ok=True)
-        with rasterio.open(out_path, "w", **profile) as dst:
-            dst.write(data)
+    data = src.read(window=Window(col0, row0, col1 - col0, row1 - row0))
+    r, c = row_off - row0, col_off - col0
+    return data[:, r:r + height, c:c + width]
+
+def clip_to_ref_bounds(src_ds, ref_bounds, ref_crs, out_path):
+    """
+    Clip an open src dataset (already in ref CRS/grid) to ref_bounds, writing a GeoTIFF.
+    Useful when src was reprojected to ref CRS but not exactly the same extent.
+    Takes open handles / plain bounds so callers don't re-open rasters they already hold.
+    """
+    assert str(src_ds.crs) == str(ref_crs), "Clip requires src already in reference CRS."
+    win = from_bounds(*ref_bounds, transform=src_ds.transform).round_offsets().round_lengths()
+    data = read_block_aligned(src_ds, win)
+    out_transform = src_ds.window_transform(win)
+    profile = src_ds.profile.copy()
+    profile.update({"height": data.shape[1], "width": data.shape[2], "transform": out_transform})
+
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    with rasterio.open(out_path, "w", **profile) as dst:
+        dst.write(data)
+        add_overviews(dst)
 
 def align_dem_to_sentinel(dem_path, sentinel_band_path, out_aligned_path, out_clipped_path=None,
-                          resampling=Resampling.bilinear, src_nodata=None, dst_nodata=-9999):
+                          resampling=Resampling.bilinear, src_nodata=None, dst_nodata=-9999,
+                          num_threads=DEFAULT_NUM_THREADS, warp_mem_limit=512,
+                          s2_dataset=None, dem_dataset=None):
     """
     High-level convenience:
       1) Read Sentinel band profile (CRS/grid).
       2) Reproject DEM onto that exact grid (write to out_aligned_path).
       3) Optionally clip to the exact Sentinel footprint (write to out_clipped_path).
+    Already-open s2_dataset / dem_dataset handles can be passed in; otherwise
+    each raster is opened once here and kept open for the whole alignment.
     Returns paths written.
     """
-    with rasterio.open(sentinel_band_path) as s2:
+    s2_ctx = nullcontext(s2_dataset) if s2_dataset is not None else rasterio.open(sentinel_band_path)
+    dem_ctx = nullcontext(dem_dataset) if dem_dataset is not None else rasterio.open(dem_path)
+    with s2_ctx as s2, dem_ctx as dem:
         ref_profile = {
             "crs": s2.crs,
             "transform": s2.transform,
@@ -115,13 +253,16 @@ def align_dem_to_sentinel(dem_path, sentinel_band_path, out_aligned_path, out_cl
             "height": s2.height
         }
 
-    _, aligned_profile = reproject_dem_to_match_profile(
-        dem_path, ref_profile, out_path=out_aligned_path,
-        resampling=resampling, src_nodata=src_nodata, dst_nodata=dst_nodata
-    )
+        _, aligned_profile = reproject_dem_to_match_profile(
+            dem_path, ref_profile, out_path=out_aligned_path,
+            resampling=resampling, src_nodata=src_nodata, dst_nodata=dst_nodata,
+            num_threads=num_threads, warp_mem_limit=warp_mem_limit,
+            dem_dataset=dem
+        )
 
-    if out_clipped_path:
-        clip_to_ref_bounds(out_aligned_path, sentinel_band_path, out_clipped_path)
-        return out_aligned_path, out_clipped_path
+        if out_clipped_path:
+            with rasterio.open(out_aligned_path) as aligned:
+                clip_to_ref_bounds(aligned, s2.bounds, s2.crs, out_clipped_path)
+            return out_aligned_path, out_clipped_path
 
     return out_aligned_path, None
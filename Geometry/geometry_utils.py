@@ -5,6 +5,7 @@ Purpose: Perform geometric checks (bounds transforms, overlap tests, and
          intersect before reprojection.
 """
 
+import numpy as np
 from rasterio.warp import transform_bounds
 
 def bounds_overlap(bounds1, bounds2):
@@ -34,3 +35,20 @@ def overlap_ratio(b1, b2):
     if inter == 0 or a1 == 0 or a2 == 0:
         return 0.0
     return inter / min(a1, a2)
+
+def bounds_overlap_batch(bounds_arr, aoi):
+    """
+    Vectorized bounds_overlap: test N bounding boxes against one AOI box.
+    bounds_arr is (N, 4) of (left, bottom, right, top); returns (N,) bool.
+    """
+    l, b, r, t = np.asarray(bounds_arr, dtype=np.float64).reshape(-1, 4).T
+    al, ab, ar, at = aoi
+    return ~((r < al) | (ar < l) | (t < ab) | (at < b))
+
+def intersection_area_batch(bounds_arr, aoi):
+    """Intersection area of N bounding boxes with one AOI box, as (N,) float."""
+    l, b, r, t = np.asarray(bounds_arr, dtype=np.float64).reshape(-1, 4).T
+    al, ab, ar, at = aoi
+    ix = np.clip(np.minimum(r, ar) - np.maximum(l, al), 0, None)
+    iy = np.clip(np.minimum(t, at) - np.maximum(b, ab), 0, None)
+    return ix * iy
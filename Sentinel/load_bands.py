@@ -4,28 +4,123 @@ Purpose: Locate and load Sentinel-2 spectral bands (B03, B08) from .SAFE folders
          and compute NDWI arrays for supraglacial lake detection workflows.
 """
 
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
 import rasterio
 import numpy as np
-from CRS.crs_utils import find_band_path
+
+try:  # optional: fused, multithreaded NDWI kernel
+    import numexpr as ne
+except ImportError:
+    ne = None
+from CRS.crs_utils import find_band_path, find_band_paths
+
+@lru_cache(maxsize=256)
+def _read_band_profile(band_path):
+    # JP2OpenJPEG is slow to initialise; skip the sibling-file scan and the shared handle
+    with rasterio.Env(GDAL_DISABLE_READDIR_ON_OPEN="EMPTY_DIR"), \
+            rasterio.open(band_path, sharing=False) as src:
+        return src.profile
 
 def load_profile_from_safe(safe_folder, band_name="B03_10m"):
     band_path = find_band_path(safe_folder, band_name)
-    with rasterio.open(band_path) as src:
-        return src.profile
+    # hand out a copy so callers can update() it without touching the cache
+    return _read_band_profile(band_path).copy()
 
 def load_band(band_path):
     with rasterio.open(band_path) as src:
-        band = src.read(1).astype(np.float32)
+        # let GDAL convert straight into float32 (no uint16 intermediate)
+        band = src.read(1, out_dtype=np.float32)
         profile = src.profile
     return band, profile
 
 def compute_ndwi(b3, b8):
-    return (b3 - b8) / (b3 + b8 + 1e-10)
+    """
+    NDWI = (B03 - B08) / (B03 + B08).
+    With numexpr installed (and float32 inputs) the expression runs as one
+    fused, multithreaded pass. Otherwise it works in float32 with in-place
+    numpy ops; b3 is reused as scratch space and is overwritten when it is
+    already a float32 array.
+    """
+    if ne is not None and b3.dtype == np.float32 and b8.dtype == np.float32:
+        return ne.evaluate("(b3 - b8) / (b3 + b8 + eps)",
+                           local_dict={"b3": b3, "b8": b8, "eps": np.float32(1e-10)})
+
+    num = np.subtract(b3, b8, dtype=np.float32)
+    if b3.dtype == np.float32:
+        den = np.add(b3, b8, out=b3)
+    else:
+        den = np.add(b3, b8, dtype=np.float32)
+    den += np.float32(1e-10)
+    return np.divide(num, den, out=num)
 
-def load_ndwi_from_safe(safe_folder):
-    b3_path = find_band_path(safe_folder, "B03_10m")
-    b8_path = find_band_path(safe_folder, "B08_10m")
-    b3, _ = load_band(b3_path)
-    b8, profile = load_band(b8_path)
+def load_green_nir_from_safe(safe_folder, num_threads="ALL_CPUS"):
+    """
+    Return (B03, B08, profile) as float32 arrays from a SAFE folder.
+    num_threads is the total GDAL decode-thread budget ("ALL_CPUS" or an int),
+    shared by the two concurrent band reads.
+    """
+    paths = find_band_paths(safe_folder, ("B03_10m", "B08_10m"))
+    b3_path, b8_path = paths["B03_10m"], paths["B08_10m"]
+    per_band = num_threads if num_threads == "ALL_CPUS" else str(max(1, int(num_threads) // 2))
+
+    # read both bands concurrently (JP2 decode releases the GIL); the Env is
+    # entered per thread so the multithreaded JP2 decoding applies in each
+    def read(band_path):
+        with rasterio.Env(GDAL_CACHEMAX=1024, GDAL_NUM_THREADS=per_band):
+            return load_band(band_path)
+
+    with ThreadPoolExecutor(max_workers=2) as ex:
+        f3 = ex.submit(read, b3_path)
+        f8 = ex.submit(read, b8_path)
+        b3, _ = f3.result()
+        b8, profile = f8.result()
+    return b3, b8, profile
+
+def load_ndwi_from_safe(safe_folder, num_threads="ALL_CPUS"):
+    b3, b8, profile = load_green_nir_from_safe(safe_folder, num_threads=num_threads)
     ndwi = compute_ndwi(b3, b8)
     return ndwi, profile
+
+def compute_ndwi_stack(safe_folders):
+    """
+    NDWI for a time series of SAFE folders on the same tile grid.
+    The (T, H, W) float32 output and the band/scratch buffers are allocated
+    once and reused for every date.
+    Returns (ndwi_stack, profiles).
+    """
+    safe_folders = list(safe_folders)
+    if not safe_folders:
+        raise ValueError("compute_ndwi_stack needs at least one SAFE folder")
+
+    out = b3 = b8 = den = None
+    profiles = []
+    for t, safe_folder in enumerate(safe_folders):
+        paths = find_band_paths(safe_folder, ("B03_10m", "B08_10m"))
+        with rasterio.open(paths["B03_10m"]) as s3, rasterio.open(paths["B08_10m"]) as s8:
+            # same size, transform and CRS for B03 vs B08 and for every date vs
+            # the first (two MGRS tiles share a 10980x10980 shape, not a grid)
+            grid8 = (s8.height, s8.width, s8.transform, s8.crs)
+            if (s3.height, s3.width, s3.transform, s3.crs) != grid8:
+                raise ValueError(f"B03 and B08 of {safe_folder} are not on the same grid")
+            if out is None:
+                grid = grid8
+                h, w = s8.height, s8.width
+                out = np.empty((len(safe_folders), h, w), dtype=np.float32)
+                b3 = np.empty((h, w), dtype=s3.dtypes[0])
+                b8 = np.empty((h, w), dtype=s8.dtypes[0])
+                den = np.empty((h, w), dtype=np.float32)
+            elif grid8 != grid:
+                raise ValueError(f"{safe_folder} is not on the same grid as {safe_folders[0]}")
+            s3.read(1, out=b3)
+            s8.read(1, out=b8)
+            profiles.append(s8.profile)
+
+        # (b3 - b8) / (b3 + b8 + eps), written straight into out[t]
+        np.subtract(b3, b8, dtype=np.float32, out=out[t])
+        np.add(b3, b8, dtype=np.float32, out=den)
+        den += np.float32(1e-10)
+        np.divide(out[t], den, out=out[t])
+
+    return out, profiles
@@ -7,10 +7,16 @@ Purpose: Identify overlapping ArcticDEM STRIP tiles, generate download lists,
 from __future__ import annotations
 import argparse
 import os
+import sys
 from pathlib import Path
 import geopandas as gpd
+import numpy as np
 from shapely.geometry import box
 
+# allow `python VRT/build_vrt.py` to import sibling packages from the repo root
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from Geometry import geometry_utils
+
 # -------------- helpers --------------
 
 def detect_url_column(df: gpd.GeoDataFrame) -> str:
@@ -59,15 +65,16 @@ def rewrite_resolution(url: str, target_res: str) -> str:
     other = "10m" if target_res == "2m" else "2m"
     return url.replace(f"/{other}/", f"/{target_res}/").replace(f"_{other}_", f"_{target_res}_")
 
-def write_fetch_script(out_dir: Path, urls_txt: Path, tiles_dir: Path, vrt_path: Path):
+def write_fetch_script(out_dir: Path, urls_txt: Path, tiles_dir: Path, vrt_path: Path, jobs: int = 8):
     """
     Write a robust downloader:
       - bypasses curl aliases (uses `command curl`)
       - disables remote-header-name (no hidden -J)
       - resumes partial downloads (-C -)
+      - fetches `jobs` archives in parallel (xargs -P; override with JOBS=N)
       - retries 10m → 2m if 10m missing (404)
       - extracts .tar.gz, deletes archives
-      - builds VRT from *_dem.tif
+      - lists extracted *_dem.tif in tiles/tiles.txt and builds the VRT from that list
     """
     urls_txt = urls_txt.resolve()
     tiles_dir = tiles_dir.resolve()
@@ -78,42 +85,57 @@ set -euo pipefail
 URLS="{urls_txt}"
 TILES="{tiles_dir}"
 VRT="{vrt_path}"
+JOBS="${{JOBS:-{jobs}}}"
+TILE_LIST="$TILES/tiles.txt"
 
 mkdir -p "$TILES"
 cd "$TILES"
 
-echo "==> Downloading ArcticDEM archives from $URLS"
-while IFS= read -r url; do
-  [[ -z "$url" ]] && continue
-
+# download + extract a single archive (runs in parallel under xargs)
+fetch_one() {{
+  local url="$1"
+  local fname
   fname="$(basename "$url")"
   echo "↓ $fname"
 
   # try as-is (likely 10m); resume, follow redirects, fail on HTTP errors
-  if ! command curl --no-remote-header-name -C - -fL --progress-bar -o "$fname" "$url"; then
+  if ! command curl --no-remote-header-name -C - -fL -sS -o "$fname" "$url"; then
     # if 10m fails (e.g., 404), try 2m variant
-    alt="${{url/\\/10m\\//\\/2m/}}"
+    local alt="${{url/\\/10m\\//\\/2m/}}"
     alt="${{alt/_10m_/_2m_}}"
+    local alt_fname
     alt_fname="$(basename "$alt")"
     echo "   10m failed. Trying 2m: $alt_fname"
-    if ! command curl --no-remote-header-name -C - -fL --progress-bar -o "$alt_fname" "$alt"; then
+    if ! command curl --no-remote-header-name -C - -fL -sS -o "$alt_fname" "$alt"; then
       echo "✗ failed both 10m and 2m for: $url"
-      continue
+      return 0
     fi
     fname="$alt_fname"
   fi
 
   echo "📦 Extracting $fname"
-  tar -xzvf "$fname"
+  local listing
+  listing="$(tar -xzvf "$fname")" || {{ echo "✗ failed to extract $fname"; return 1; }}
   rm -f "$fname"
-done < "$URLS"
+
+  # record extracted DEMs for gdalbuildvrt -input_file_list
+  grep '_dem\.tif$' <<< "$listing" | sed "s|^|$TILES/|" >> "$TILE_LIST" || true
+}}
+export -f fetch_one
+export TILES TILE_LIST
+
+echo "==> Downloading ArcticDEM archives from $URLS ($JOBS in parallel)"
+sed '/^[[:space:]]*$/d' "$URLS" | xargs -n1 -P "$JOBS" bash -c 'fetch_one "$1"' _
 
 echo "==> Keeping only DEM GeoTIFFs (optional cleanup of extras)"
 # Comment out the next line if you want to keep QA/mask files too
 find "$TILES" -type f -name "*.tif" ! -name "*_dem.tif" -delete
 
 echo "==> Building VRT"
-gdalbuildvrt -overwrite "$VRT" "$TILES"/*_dem.tif
+# explicit file list: no shell glob (ARG_MAX) and no directory re-scan
+touch "$TILE_LIST"
+sort -u "$TILE_LIST" -o "$TILE_LIST"
+gdalbuildvrt -overwrite -input_file_list "$TILE_LIST" -resolution highest -r nearest -vrtnodata -9999 "$VRT"
 
 echo "✅ Done. VRT at: $VRT"
 """
@@ -138,6 +160,7 @@ def main():
     ap.add_argument("--sentinel-crs", default="EPSG:32622", help="CRS of sentinel-bounds")
     ap.add_argument("--buffer-m", type=float, default=1000.0, help="Buffer (meters) around AOI")
     ap.add_argument("--resolution", choices=["2m","10m"], default="10m", help="DEM resolution to download")
+    ap.add_argument("--jobs", type=int, default=8, help="Parallel downloads in fetch-dem.sh")
     ap.add_argument(
         "--max-strips",
         type=int,
@@ -161,16 +184,42 @@ def main():
     if str(idx.crs) != args.sentinel_crs:
         idx = idx.to_crs(args.sentinel_crs)
 
-    # Select overlapping strips
-    sel = idx[idx.intersects(aoi)].copy()
+    # Select strips whose bounding boxes overlap the AOI: one vectorized NumPy
+    # test over all strips; the exact GEOS intersection is only run on the
+    # shortlist below (and zero-area false positives are dropped there)
+    aoi_bounds = aoi.bounds
+    sel = idx[geometry_utils.bounds_overlap_batch(idx.bounds.values, aoi_bounds)].copy()
     print(f"Found {len(sel)} overlapping DEM strips.")
     if sel.empty:
         raise SystemExit("No overlapping strips found. Increase buffer or verify CRS/bounds.")
 
     # ---------- NEW: rank by intersection area (+ date if available) ----------
 
+    max_k = max(1, args.max_strips)
+
+    # Two-stage ranking: the envelope-overlap area is a cheap upper bound on the
+    # exact intersection area. Walk strips in descending upper bound, computing
+    # exact (GEOS) areas chunk by chunk, and stop once the K-th best exact area
+    # beats every remaining bound -- no unvisited strip can enter the top-K.
+    # (strictly beats: a strip tied with the K-th area may still win on date)
+    approx_area = geometry_utils.intersection_area_batch(sel.bounds.values, aoi_bounds)
+    order = np.argsort(-approx_area, kind="stable")
+    exact_area = np.zeros(len(sel))
+    chunk = max(4 * max_k, 64)
+    n_done = 0
+    while n_done < len(order):
+        rows = order[n_done:n_done + chunk]
+        exact_area[rows] = sel.geometry.iloc[rows].intersection(aoi).area.values
+        n_done += len(rows)
+        if n_done >= max_k and n_done < len(order):
+            kth_area = np.partition(exact_area[order[:n_done]], -max_k)[-max_k]
+            if kth_area > approx_area[order[n_done]]:
+                break
+    print(f"Computed exact intersections for {n_done} of {len(sel)} strips.")
+
     # Intersection area with AOI
-    sel["intersect_area"] = sel.geometry.intersection(aoi).area
+    sel = sel.iloc[order[:n_done]].copy()
+    sel["intersect_area"] = exact_area[order[:n_done]]
 
     # Drop anything with zero / NaN intersect area, just in case
     sel = sel[sel["intersect_area"] > 0]
@@ -181,10 +230,21 @@ def main():
     id_col  = detect_id_column(sel)
     date_col = detect_date_column(sel)
 
-    if date_col is not None:
+    # Only rows with an area >= the K-th best can make the top-K (ties are then
+    # broken by date), so dates are only parsed for those
+    kth_area = sel["intersect_area"].nlargest(max_k).min()
+    sel = sel[sel["intersect_area"] >= kth_area].copy()
+
+    if date_col is not None and not gpd.pd.api.types.is_datetime64_any_dtype(sel[date_col]):
         # try to coerce to datetime, ignore errors
         try:
-            sel[date_col] = gpd.pd.to_datetime(sel[date_col], errors="coerce")
+            # explicit format skips dateutil's per-value format detection;
+            # only the rows that don't match it go through the slow generic parse
+            parsed = gpd.pd.to_datetime(sel[date_col], format="%Y-%m-%d", errors="coerce", cache=True)
+            mask = parsed.isna() & sel[date_col].notna()
+            if mask.any():
+                parsed[mask] = gpd.pd.to_datetime(sel.loc[mask, date_col], errors="coerce")
+            sel[date_col] = parsed
         except Exception:
             # if conversion fails, just ignore date
             date_col = None
@@ -199,7 +259,6 @@ def main():
     sel = sel.sort_values(by=sort_cols, ascending=ascending)
 
     # Keep only top-K strips
-    max_k = max(1, args.max_strips)
     sel_best = sel.head(max_k).copy()
 
     print(f"Selected top {len(sel_best)} strips (max-strips={max_k}) after ranking.")
@@ -236,7 +295,7 @@ def main():
 
     # Write fetch script (with fixed curl flags)
     fetch_sh = write_fetch_script(out_dir=out_dir, urls_txt=chosen_copy,
-                                  tiles_dir=tiles_dir, vrt_path=vrt_path)
+                                  tiles_dir=tiles_dir, vrt_path=vrt_path, jobs=args.jobs)
     print(f"Fetch script ready: {fetch_sh}")
     print("Run:\n  bash", fetch_sh)
 
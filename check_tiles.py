@@ -2,36 +2,51 @@
 check_tiles.py for sanity check code
 """
 
+import os
 from pathlib import Path
 import numpy as np
 
 IMAGES_DIR = Path("data/tiles/images")
 MASKS_DIR  = Path("data/tiles/masks")
 
-def load_first_array(npz_path):
-    data = np.load(npz_path)
+def stems_in(folder, suffix):
+    n = len(suffix)
+    with os.scandir(folder) as it:
+        return {e.name[:-n] for e in it if e.name.endswith(suffix)}
+
+def load_first_array(tile_path):
+    if tile_path.suffix == ".npy":
+        return np.load(tile_path, mmap_mode="r")
+    data = np.load(tile_path)
     # Use the first array stored in the npz file
     key = list(data.files)[0]
     return data[key]
 
 def main():
-    image_files = sorted(IMAGES_DIR.glob("*.npz"))
-    mask_files  = sorted(MASKS_DIR.glob("*.npz"))
+    # .npy is the current tile format, .npz the older compressed one,
+    # .shard.npy one stacked (N, ...) array per raster (make_tiles.py --sharded)
+    with os.scandir(IMAGES_DIR) as it:
+        names = [e.name for e in it]
+    if any(n.endswith(".shard.npy") for n in names):
+        suffix = ".shard.npy"
+    else:
+        suffix = ".npy" if any(n.endswith(".npy") for n in names) else ".npz"
 
-    print(f"Found {len(image_files)} image tiles")
-    print(f"Found {len(mask_files)} mask tiles")
+    # one scandir pass per folder; names stay plain strings (no Path/stat per file)
+    image_stems = stems_in(IMAGES_DIR, suffix)
+    mask_stems  = stems_in(MASKS_DIR, suffix)
 
-    if len(image_files) == 0:
+    print(f"Found {len(image_stems)} image tiles")
+    print(f"Found {len(mask_stems)} mask tiles")
+
+    if len(image_stems) == 0:
         print("⚠️ No image tiles found. Check your paths or extensions.")
         return
-    if len(mask_files) == 0:
+    if len(mask_stems) == 0:
         print("⚠️ No mask tiles found. Check your paths or extensions.")
         return
 
     # Pair by stem (filename without extension)
-    image_stems = {f.stem for f in image_files}
-    mask_stems  = {f.stem for f in mask_files}
-
     missing_masks  = image_stems - mask_stems
     missing_images = mask_stems - image_stems
 
@@ -48,9 +63,10 @@ def main():
     if not missing_masks and not missing_images:
         print("✅ Every image has a matching mask (by stem).")
 
-    # Inspect one sample pair
-    sample_img = image_files[0]
-    sample_mask = MASKS_DIR / (sample_img.stem + ".npz")
+    # Inspect one sample pair (first by name)
+    sample_stem = min(image_stems)
+    sample_img = IMAGES_DIR / (sample_stem + suffix)
+    sample_mask = MASKS_DIR / (sample_stem + suffix)
 
     print("\nInspecting sample pair:")
     print("  Image:", sample_img)
@@ -1,7 +1,9 @@
 """
-Workflow: npz -> NumPy array -> torch tensor -> U-Net -> logits -> loss -> gradients
+Workflow: npy/npz/shard.npy -> NumPy array -> torch tensor -> U-Net -> logits -> loss -> gradients
 """
 
+import os
+import pickle
 from pathlib import Path
 from typing import Optional, Callable, Tuple
 
@@ -10,55 +12,178 @@ import torch
 from torch.utils.data import Dataset
 
 
+# int16 tiles store round(NDWI * NDWI_SCALE); must match make_tiles.NDWI_SCALE
+NDWI_SCALE = 10000
+# one stacked (N, ...) array per raster; must match make_tiles.SHARD_SUFFIX
+SHARD_SUFFIX = ".shard.npy"
+
+
+def dequantize_ndwi(img: torch.Tensor) -> torch.Tensor:
+    """int16 NDWI (NDWI * NDWI_SCALE) or float16 NDWI -> float32 NDWI; float32 passes through."""
+    if img.dtype == torch.int16:
+        return img.float().mul_(1.0 / NDWI_SCALE)
+    if img.dtype == torch.float16:
+        return img.float()
+    return img
+
+
+def _has_suffix(folder: Path, suffix: str) -> bool:
+    with os.scandir(folder) as it:
+        return any(e.name.endswith(suffix) for e in it)
+
+
+def _list_stems(folder: Path, suffix: str) -> set[str]:
+    n = len(suffix)
+    with os.scandir(folder) as it:
+        return {e.name[:-n] for e in it if e.name.endswith(suffix)}
+
+
 class LakeTileDataset(Dataset):
+    """
+    NDWI/mask tile pairs as (1, H, W) float32 tensors.
+
+    Images come back without a dtype cast or extra copy, so pair this with
+    DataLoader(..., pin_memory=True, persistent_workers=True, prefetch_factor=4)
+    and .to(device, non_blocking=True) when training on a GPU.
+
+    int16 (quantized) and float16 tiles are converted to float32 here by
+    default. With dequantize=False they are returned as int16/float16 tensors
+    instead (half the bytes through the loader and H2D copy); call
+    dequantize_ndwi() on the batch once it is on the device.
+
+    Folders of <base>.shard.npy files (make_tiles.py --sharded) are read as
+    well: every row of every shard is one tile, memory-mapped on demand.
+    """
     def __init__(
         self,
         images_dir: str | Path,
         masks_dir: str | Path,
         transform: Optional[Callable] = None,
+        dequantize: bool = True,
     ):
         self.images_dir = Path(images_dir)
         self.masks_dir = Path(masks_dir)
         self.transform = transform # for later augmentation
-
-        # extraction
-        image_files = sorted(self.images_dir.glob("*.npz"))
-        mask_files = sorted(self.masks_dir.glob("*.npz"))
-
-        # Pair by stem
-        image_stems = {f.stem for f in image_files}
-        mask_stems = {f.stem for f in mask_files}
+        self.dequantize = dequantize
+
+        # extraction (.npy tiles are memory-mapped, .npz is the older compressed format)
+        if _has_suffix(self.images_dir, SHARD_SUFFIX):
+            self.suffix = SHARD_SUFFIX
+        else:
+            self.suffix = ".npy" if _has_suffix(self.images_dir, ".npy") else ".npz"
+        self.stems = self._load_or_scan_stems()
+
+        # sharded: one (stem, row) entry per tile; shards are opened lazily per worker
+        self.sharded = self.suffix == SHARD_SUFFIX
+        self._shards = {}
+        self.index = None
+        if self.sharded:
+            self.index = [
+                (stem, row)
+                for stem in self.stems
+                for row in range(np.load(self.images_dir / f"{stem}{self.suffix}",
+                                         mmap_mode="r").shape[0])
+            ]
+
+    def _scan_stems(self) -> list[str]:
+        # Pair by stem (plain strings from one scandir pass, no Path/stat per file)
+        image_stems = _list_stems(self.images_dir, self.suffix)
+        mask_stems = _list_stems(self.masks_dir, self.suffix)
         common_stems = sorted(image_stems & mask_stems)
 
         if not common_stems:
             raise RuntimeError("No matching image/mask stems found!")
 
-        self.stems = common_stems
+        return common_stems
+
+    def _load_or_scan_stems(self) -> list[str]:
+        """
+        Reuse the paired stems from a pickle sidecar while both tile folders
+        are unchanged (same mtimes); otherwise rescan and refresh the sidecar.
+        The sidecar sits next to images_dir so writing it doesn't bump the
+        folder mtime it is keyed on.
+        """
+        cache_path = self.images_dir.parent / f".{self.images_dir.name}_stems.pkl"
+        key = (
+            str(self.images_dir.resolve()), str(self.masks_dir.resolve()), self.suffix,
+            self.images_dir.stat().st_mtime_ns, self.masks_dir.stat().st_mtime_ns,
+        )
+
+        try:
+            with open(cache_path, "rb") as f:
+                cached_key, stems = pickle.load(f)
+            if cached_key == key:
+                return stems
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            pass
+
+        stems = self._scan_stems()
+        try:
+            with open(cache_path, "wb") as f:
+                pickle.dump((key, stems), f)
+        except OSError:
+            pass  # read-only tile folder: just skip caching
+        return stems
 
     def __len__(self) -> int:
-        return len(self.stems)
-
-    def _load_npz_first_array(self, path: Path) -> np.ndarray:
+        return len(self.index) if self.sharded else len(self.stems)
+
+    def __getstate__(self):
+        # don't ship open memmaps to DataLoader workers; each reopens its own
+        state = self.__dict__.copy()
+        state["_shards"] = {}
+        return state
+
+    def _shard(self, stem: str) -> Tuple[np.ndarray, np.ndarray]:
+        if stem not in self._shards:
+            self._shards[stem] = (
+                np.load(self.images_dir / f"{stem}{self.suffix}", mmap_mode="r"),
+                np.load(self.masks_dir / f"{stem}{self.suffix}", mmap_mode="r"),
+            )
+        return self._shards[stem]
+
+    def _load_tile_array(self, path: Path) -> np.ndarray:
+        if path.suffix == ".npy":
+            # memory-mapped: only this tile's bytes are faulted in, then
+            # copied once into a regular (writable) array
+            return np.array(np.load(path, mmap_mode="r"))
         data = np.load(path)
         key = list(data.files)[0]
         return data[key]
 
     # Heart of the dataset file
     def __getitem__(self, idx: int) -> Tuple[torch.Tensor, torch.Tensor]:
-        stem = self.stems[idx]
-        img_path = self.images_dir / f"{stem}.npz"
-        mask_path = self.masks_dir / f"{stem}.npz"
-
-        img_np = self._load_npz_first_array(img_path)   # (1, H, W)
-        mask_np = self._load_npz_first_array(mask_path) # (H, W)
+        if self.sharded:
+            stem, row = self.index[idx]
+            imgs, masks = self._shard(stem)
+            img_np = np.array(imgs[row])    # (1, H, W)
+            mask_np = np.array(masks[row])  # (H, W)
+        else:
+            stem = self.stems[idx]
+            img_path = self.images_dir / f"{stem}{self.suffix}"
+            mask_path = self.masks_dir / f"{stem}{self.suffix}"
+
+            img_np = self._load_tile_array(img_path)   # (1, H, W)
+            mask_np = self._load_tile_array(mask_path) # (H, W)
 
         # Ensure shapes (1, H, W)
         if mask_np.ndim == 2:
             mask_np = mask_np[None, ...]  # (1, H, W)
 
         # convert to tensors
-        img = torch.from_numpy(img_np).float()          # (1, H, W)
-        mask = torch.from_numpy(mask_np).float()        # (1, H, W)
+        if img_np.dtype == np.int16:
+            if self.dequantize:
+                img_np = np.multiply(img_np, np.float32(1.0 / NDWI_SCALE), dtype=np.float32)
+        elif img_np.dtype == np.float16:
+            if self.dequantize:
+                img_np = img_np.astype(np.float32)
+        else:
+            # float32 tiles: normally a no-op + zero-copy
+            img_np = img_np.astype(np.float32, copy=False)
+        # contiguous (1, H, W) at the dataset boundary: no hidden copy later in
+        # collate / .to(device); ascontiguousarray is a no-op for the usual case
+        img = torch.as_tensor(np.ascontiguousarray(img_np))    # (1, H, W)
+        mask = torch.as_tensor(np.ascontiguousarray(mask_np)).float()  # (1, H, W)
 
         if self.transform is not None:
             img, mask = self.transform(img, mask)
@@ -12,68 +12,183 @@ print("PYTHON USED:", sys.executable)
 import os
 import re
 import glob
+import hashlib
 import argparse
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 import rasterio
 from rasterio.transform import array_bounds
 from rasterio.warp import reproject, Resampling
 from rasterio.features import shapes
+import shapely
 from shapely.geometry import shape
 import geopandas as gpd
 
+try:  # optional: fused NDWI + DEM filter kernel
+    from numba import njit, prange
+except ImportError:
+    njit = None
+    prange = range
+
 from Sentinel import load_bands
 from CRS import crs_utils
 from DEM import dem_utils
 from Geometry import geometry_utils
 
+SHAPELY_2 = int(shapely.__version__.split(".")[0]) >= 2
+
+# SAFE name parts, e.g. S2A_MSIL2A_20240803T..._T22WDA_...
+_DATE_RE = re.compile(r"_(\d{8})T")
+_TILE_RE = re.compile(r"_(T\d{2}[A-Z]{3})_")
+
+# tiled 512x512 deflate+predictor GeoTIFF: with overviews this is the COG layout
+MASK_TIFF_OPTIONS = dict(driver="GTiff", tiled=True, blockxsize=512, blockysize=512,
+                         compress="deflate", predictor=2, BIGTIFF="IF_SAFER")
+
 # helpers to modularize
 def safe_id(safe_path: str):
     """Return (YYYY-MM-DD, 'T22WDA', basename) from a SAFE folder name."""
     name = os.path.basename(safe_path.rstrip("/"))
-    m_date = re.search(r"_(\d{8})T", name)
+    m_date = _DATE_RE.search(name)
     date_str = ""
     if m_date:
         ymd = m_date.group(1)
         date_str = f"{ymd[:4]}-{ymd[4:6]}-{ymd[6:]}"
-    m_tile = re.search(r"_(T\d{2}[A-Z]{3})_", name)
+    m_tile = _TILE_RE.search(name)
     tile = m_tile.group(1) if m_tile else "TXXXX"
     return date_str, tile, name
 
+def _lake_mask_kernel(green, nir, dem, ndwi_thr, elev_min, dem_nodata, ndwi_mask, lake_mask):
+    h, w = green.shape
+    for i in prange(h):
+        for j in range(w):
+            g = green[i, j]
+            n = nir[i, j]
+            water = (g - n) / (g + n + 1e-10) > ndwi_thr
+            d = dem[i, j]
+            ndwi_mask[i, j] = water
+            lake_mask[i, j] = water and d > elev_min and d != dem_nodata
+
+if njit is not None:
+    _lake_mask_kernel = njit(parallel=True, cache=True)(_lake_mask_kernel)
+
+def compute_lake_mask(green, nir, dem, ndwi_thr, elev_min, dem_nodata=None):
+    """
+    NDWI -> threshold -> DEM filter for green/NIR/DEM arrays on one grid.
+    Returns (ndwi_mask, lake_mask) as uint8. With Numba this is a single
+    parallel pass and no float NDWI array is ever materialized.
+    """
+    nodata = np.nan if dem_nodata is None else float(dem_nodata)
+    ndwi_mask = np.empty(green.shape, dtype=np.uint8)
+    lake_mask = np.empty(green.shape, dtype=np.uint8)
+    if njit is not None:
+        _lake_mask_kernel(green, nir, dem, float(ndwi_thr), float(elev_min), nodata,
+                          ndwi_mask, lake_mask)
+    else:
+        water = load_bands.compute_ndwi(green, nir) > ndwi_thr
+        ndwi_mask[:] = water
+        lake_mask[:] = water & (dem > elev_min) & (dem != nodata)
+    return ndwi_mask, lake_mask
+
+def polygons_from_shapes(shape_iter):
+    """
+    GeoJSON polygons from rasterio.features.shapes -> array of Shapely polygons.
+    All rings (exteriors and holes) are packed into one coordinate array and
+    built in a single shapely.from_ragged_array call (Shapely >= 2).
+    """
+    coords, ring_offsets, poly_offsets = [], [0], [0]
+    n_coords = 0
+    for geom, _ in shape_iter:
+        for ring in geom["coordinates"]:
+            ring = np.asarray(ring, dtype=np.float64)
+            coords.append(ring)
+            n_coords += len(ring)
+            ring_offsets.append(n_coords)
+        poly_offsets.append(len(ring_offsets) - 1)
+
+    if not coords:
+        return np.empty(0, dtype=object)
+
+    geoms = shapely.from_ragged_array(
+        shapely.GeometryType.POLYGON,
+        np.concatenate(coords),
+        (np.asarray(ring_offsets, dtype=np.int64), np.asarray(poly_offsets, dtype=np.int64)),
+    )
+    invalid = ~shapely.is_valid(geoms)
+    if invalid.any():
+        geoms[invalid] = shapely.buffer(geoms[invalid], 0)  # clean tiny topo errors
+    return geoms
+
 def polygonize_mask_to_vectors(mask_path: str, out_path: str,
                                min_area_m2: float,
                                safe_name: str,
                                ndwi_thr: float,
-                               elev_min: float):
-    """Binary mask (1=lake) -> vector polygons with area filter in meters."""
+                               elev_min: float,
+                               simplify_tol: float = None,
+                               acq_date: str = None):
+    """
+    Binary mask (1=lake) -> vector polygons with area filter in meters.
+    Polygons are simplified (Douglas-Peucker) with simplify_tol, defaulting
+    to half a pixel; pass 0 to keep the raw pixel-stepped outlines.
+    acq_date (YYYY-MM-DD) is parsed from safe_name when not given.
+    """
     with rasterio.open(mask_path) as src:
         arr = src.read(1)
         transform = src.transform
         crs = src.crs
 
-    feats = []
-    for geom, val in shapes(arr, transform=transform):
-        if int(val) != 1:
-            continue
-        feats.append(shape(geom).buffer(0))  # clean tiny topo errors
-
-    if not feats:
+    # mask=... makes GDAL trace only lake pixels instead of every background region
+    lake_shapes = shapes(arr, mask=(arr == 1), transform=transform)
+    if SHAPELY_2:
+        feats = polygons_from_shapes(lake_shapes)
+    else:
+        feats = []
+        for geom, _ in lake_shapes:
+            poly = shape(geom)
+            if not poly.is_valid:
+                poly = poly.buffer(0)  # clean tiny topo errors
+            feats.append(poly)
+
+    if len(feats) == 0:
         print("⚠️ No polygons found after thresholding.")
         return None
 
     gdf = gpd.GeoDataFrame(geometry=feats, crs=crs)
-    gdf_m = gdf.to_crs(32622)  # Jakobshavn UTM zone → meters
+    same_crs = gdf.crs.to_epsg() == 32622
+
+    # Sentinel grids are UTM (metres): drop small polygons before reprojecting
+    # so only survivors go through to_crs. In a different UTM zone areas differ
+    # slightly, so pre-filter with some slack and apply the exact cut below.
+    if gdf.crs.axis_info and gdf.crs.axis_info[0].unit_name == "metre":
+        slack = 1.0 if same_crs else 0.9
+        gdf = gdf[gdf.area >= slack * float(min_area_m2)]
+
+    gdf_m = gdf.copy() if same_crs else gdf.to_crs(32622)  # Jakobshavn UTM zone → meters
     gdf_m["area_m2"] = gdf_m.area
     gdf_m = gdf_m[gdf_m["area_m2"] >= float(min_area_m2)]
     if gdf_m.empty:
         print("⚠️ All polygons filtered out by min area.")
         return None
 
+    # drop the collinear 10 m pixel-step vertices. The default tolerance is half
+    # a pixel so 1-2 px wide lakes keep their shape; any empty/invalid result
+    # keeps its original outline. area_m2 stays the raster-derived area.
+    tol = 0.5 * abs(transform.a) if simplify_tol is None else float(simplify_tol)
+    if tol > 0:
+        if SHAPELY_2:
+            simplified = gpd.GeoSeries(
+                shapely.simplify(gdf_m.geometry.values, tolerance=tol, preserve_topology=True),
+                index=gdf_m.index, crs=gdf_m.crs)
+        else:
+            simplified = gdf_m.geometry.simplify(tol, preserve_topology=True)
+        bad = simplified.is_empty | ~simplified.is_valid
+        gdf_m["geometry"] = simplified.where(~bad, gdf_m.geometry)
+
     # metadata
-    acq_date = ""
-    m = re.search(r"_(\d{8})T", safe_name)
-    if m:
-        ymd = m.group(1); acq_date = f"{ymd[:4]}-{ymd[4:6]}-{ymd[6:]}"
+    if acq_date is None:
+        acq_date = safe_id(safe_name)[0]
     gdf_m["safe_name"] = safe_name
     gdf_m["date"] = acq_date
     gdf_m["ndwi_thr"] = ndwi_thr
@@ -83,72 +198,107 @@ def polygonize_mask_to_vectors(mask_path: str, out_path: str,
     gdf_m.to_file(out_path, driver=driver)
     return out_path
 
-def process_safe(safe_path: str, dem_path: str, out_root: str,
-                 ndwi_thresh: float, elev_min: float, min_area_m2: float,
-                 vector_ext: str = ".gpkg"):
-    os.makedirs(out_root, exist_ok=True)
-    date_str, tile, safe_name = safe_id(safe_path)
-    tag = f"{date_str}_{tile}" if date_str else os.path.basename(safe_path).replace(".SAFE", "")
-
-    # PART 01 Sentinel SAFE (Reference Grid)
-    sentinel_crs, sentinel_epsg = crs_utils.get_safe_crs(safe_path)
+def safe_and_dem_bounds(safe_path: str, dem_path: str):
+    """Return (sentinel_bounds, dem_bounds_in_s2), both in the SAFE's CRS."""
+    sentinel_crs, _ = crs_utils.get_safe_crs(safe_path)
     profile = load_bands.load_profile_from_safe(safe_path, "B03_10m")
     sentinel_bounds = array_bounds(profile["height"], profile["width"], profile["transform"])
 
-    print("📌 Sentinel EPSG:", sentinel_epsg)
-    print("🧭 Sentinel bounds:", sentinel_bounds)
-
-    # PART 02 DEM (A Mosaic VRT - using gdalbuildvrt)
     with rasterio.open(dem_path) as dem_src:
         dem_crs = dem_src.crs
         dem_bounds = dem_src.bounds
 
     dem_bounds_in_s2 = geometry_utils.transform_bounds_to_match_crs(
         bounds=dem_bounds, src_crs=dem_crs, dst_crs=sentinel_crs)
-
-    if not geometry_utils.bounds_overlap(dem_bounds_in_s2, sentinel_bounds):
-        print(f"❌ DEM does not cover {tag}. Skipping.")
-        return
-    print(f"✅ DEM-Sentinel overlap ratio: "
-          f"{geometry_utils.overlap_ratio(dem_bounds_in_s2, sentinel_bounds):.3f}")
-
-    # PART 03 Align DEM to Sentinel grid (writes GeoTIFFs)
-
+    return sentinel_bounds, dem_bounds_in_s2
+
+def _init_batch_worker(gdal_threads: int):
+    """ProcessPoolExecutor initializer: cap GDAL threads for anything not run in an explicit Env."""
+    os.environ["GDAL_NUM_THREADS"] = str(gdal_threads)
+
+def dem_fingerprint(dem_path: str, tile: str) -> str:
+    """Short cache key for a DEM on a tile; changes if the DEM file is replaced."""
+    dem_abs = os.path.abspath(dem_path)
+    mtime = os.path.getmtime(dem_abs) if os.path.exists(dem_abs) else 0
+    digest = hashlib.md5(f"{dem_abs}:{mtime}".encode()).hexdigest()[:8]
+    return f"{tile}_{digest}"
+
+def ensure_dem_alignment(safe_path: str, dem_path: str, out_root: str,
+                         num_threads: int = dem_utils.DEFAULT_NUM_THREADS, warp_mem_mb: int = 512):
+    """
+    Return (aligned_dem_path, clipped_dem_path) for the SAFE's grid, aligning
+    the DEM only if the cached GeoTIFFs under out_root/dem_cache/<tile> don't exist yet.
+    """
     print("📁 Checking cached DEM alignments…")
 
     s2_b03_path = crs_utils.find_band_path(safe_path, "B03_10m")
 
-    # reducing recomputation over same target grid across temporal scales
-    aligned_dem_path = os.path.join(out_root, "dem_to_sentinel.tif")
-    clipped_dem_path = os.path.join(out_root, "dem_to_sentinel_clipped.tif")
+    # keyed on (tile, DEM path + mtime) so every date of a tile shares one alignment
+    _, tile, _ = safe_id(safe_path)
+    dem_cache_dir = os.path.join(out_root, "dem_cache", tile)
+    fingerprint = dem_fingerprint(dem_path, tile)
+    aligned_dem_path = os.path.join(dem_cache_dir, f"aligned_{fingerprint}.tif")
+    clipped_dem_path = os.path.join(dem_cache_dir, f"aligned_{fingerprint}_clipped.tif")
 
     need_align = not os.path.exists(aligned_dem_path)
     need_clip = not os.path.exists(clipped_dem_path)
 
     if need_align or need_clip:
         print("🔄 Computing DEM alignment (first time)…")
+        os.makedirs(dem_cache_dir, exist_ok=True)
         aligned_dem_path, clipped_dem_path = dem_utils.align_dem_to_sentinel(
             dem_path=dem_path,
             sentinel_band_path=s2_b03_path,
             out_aligned_path=aligned_dem_path,
             out_clipped_path=clipped_dem_path,
-            dst_nodata=-9999
+            dst_nodata=-9999,
+            num_threads=num_threads,
+            warp_mem_limit=warp_mem_mb
         )
     else:
         print("🗺️ Reusing existing DEM alignment:", aligned_dem_path)
         print("✂️  Reusing existing DEM clip:", clipped_dem_path)
 
-    # PART 04 NDWI + Save Raw Mask
-    ndwi, ndwi_profile = load_bands.load_ndwi_from_safe(safe_path)
-    ndwi_mask = (ndwi > ndwi_thresh).astype(np.uint8)
-    ndwi_mask_path = os.path.join(out_root, f"{tag}_ndwi_{ndwi_thresh:.2f}.tif")
-    mask_profile = ndwi_profile.copy()
-    mask_profile.update(dtype=rasterio.uint8, count=1, nodata=0, compress="deflate")
-    with rasterio.open(ndwi_mask_path, "w", **mask_profile) as dst:
-        dst.write(ndwi_mask, 1)
-    print("💾 Raw NDWI mask saved:", ndwi_mask_path)
-
-    # PART 05 DEM filter (Ensuring Same Grid)
+    return aligned_dem_path, clipped_dem_path
+
+def write_mask_tif(path: str, mask: np.ndarray, profile: dict):
+    """Write a 0/1 mask as a tiled uint8 GeoTIFF with nearest-neighbour internal overviews."""
+    profile = {**profile, **MASK_TIFF_OPTIONS, "dtype": rasterio.uint8, "count": 1, "nodata": 0}
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(mask.astype(np.uint8, copy=False), 1)
+        dem_utils.add_overviews(dst, resampling=Resampling.nearest)
+
+def process_safe(safe_path: str, dem_path: str, out_root: str,
+                 ndwi_thresh: float, elev_min: float, min_area_m2: float,
+                 vector_ext: str = ".gpkg", simplify_tol: float = None,
+                 write_ndwi_mask: bool = True,
+                 num_threads: int = dem_utils.DEFAULT_NUM_THREADS, warp_mem_mb: int = 512):
+    os.makedirs(out_root, exist_ok=True)
+    date_str, tile, safe_name = safe_id(safe_path)
+    tag = f"{date_str}_{tile}" if date_str else os.path.basename(safe_path).replace(".SAFE", "")
+
+    # PART 01 Sentinel SAFE (Reference Grid)
+    _, sentinel_epsg = crs_utils.get_safe_crs(safe_path)
+    profile = load_bands.load_profile_from_safe(safe_path, "B03_10m")
+
+    # PART 02 DEM (A Mosaic VRT - using gdalbuildvrt)
+    sentinel_bounds, dem_bounds_in_s2 = safe_and_dem_bounds(safe_path, dem_path)
+
+    print("📌 Sentinel EPSG:", sentinel_epsg)
+    print("🧭 Sentinel bounds:", sentinel_bounds)
+
+    if not geometry_utils.bounds_overlap(dem_bounds_in_s2, sentinel_bounds):
+        print(f"❌ DEM does not cover {tag}. Skipping.")
+        return
+    print(f"✅ DEM-Sentinel overlap ratio: "
+          f"{geometry_utils.overlap_ratio(dem_bounds_in_s2, sentinel_bounds):.3f}")
+
+    # PART 03 Align DEM to Sentinel grid (writes GeoTIFFs)
+
+    aligned_dem_path, clipped_dem_path = ensure_dem_alignment(
+        safe_path, dem_path, out_root, num_threads=num_threads, warp_mem_mb=warp_mem_mb)
+
+    # PART 04 DEM on the reference grid
     print("🔎 reading clipped DEM:", clipped_dem_path)
     with rasterio.open(clipped_dem_path) as dem_ds:
         dem_arr = dem_ds.read(1)  # DEM values
@@ -160,47 +310,55 @@ def process_safe(safe_path: str, dem_path: str, out_root: str,
         # dem_extent = [dem_ds.bounds.left, dem_ds.bounds.right,
         #               dem_ds.bounds.bottom, dem_ds.bounds.top]
 
-    # now work with arrays (dataset is closed)
-    dem_float = dem_arr.astype("float32")
-    if dem_nodata is not None:
-        dem_masked = np.where(dem_arr == dem_nodata, np.nan, dem_float)
+    # PART 05 NDWI mask + DEM filter (Ensuring Same Grid)
+    same_grid = (
+            profile["width"] == dem_w and profile["height"] == dem_h and
+            profile["crs"] == dem_crs and profile["transform"] == dem_transform
+    )
+    if same_grid:
+        # usual case: one fused pass (NDWI -> threshold -> DEM filter) over the bands
+        green, nir, ndwi_profile = load_bands.load_green_nir_from_safe(
+            safe_path, num_threads=num_threads)
+        ndwi_mask, lake_mask = compute_lake_mask(green, nir, dem_arr, ndwi_thresh, elev_min, dem_nodata)
+        del green, nir
     else:
-        dem_masked = dem_float
-
-    # Ensure NDWI mask grid matches DEM grid (size/transform/CRS)
-    with rasterio.open(ndwi_mask_path) as msk_src:
-        same_grid = (
-                msk_src.width == dem_w and msk_src.height == dem_h and
-                msk_src.crs == dem_crs and msk_src.transform == dem_transform
+        ndwi, ndwi_profile = load_bands.load_ndwi_from_safe(safe_path, num_threads=num_threads)
+        ndwi_mask = (ndwi > ndwi_thresh).astype(np.uint8)
+        del ndwi
+
+        # Regrid the NDWI mask onto the DEM grid (size/transform/CRS)
+        mask_on_dem = np.zeros((dem_h, dem_w), dtype=np.uint8)
+        reproject(
+            source=ndwi_mask,
+            destination=mask_on_dem,
+            src_transform=ndwi_profile["transform"],
+            src_crs=ndwi_profile["crs"],
+            dst_transform=dem_transform,
+            dst_crs=dem_crs,
+            resampling=Resampling.nearest,
+            src_nodata=0,
+            dst_nodata=0,
+            num_threads=num_threads,
+            warp_mem_limit=warp_mem_mb,
         )
-        if not same_grid:
-            reproj = np.zeros((dem_h, dem_w), dtype=np.uint8)
-            reproject(
-                source=rasterio.band(msk_src, 1),
-                destination=reproj,
-                src_transform=msk_src.transform,
-                src_crs=msk_src.crs,
-                dst_transform=dem_transform,
-                dst_crs=dem_crs,
-                resampling=Resampling.nearest,
-                dst_nodata=0,
-            )
-            ndwi_mask = reproj
-        else:
-            ndwi_mask = msk_src.read(1)
+        # DEM filter straight on the DEM's own dtype (no float copy / NaN fill);
+        # nodata pixels are excluded explicitly and masks are combined in place
+        lake_mask = mask_on_dem == 1
+        del mask_on_dem
+        lake_mask &= dem_arr > elev_min
+        if dem_nodata is not None:
+            lake_mask &= dem_arr != dem_nodata
+
+    # Save Raw NDWI Mask (make_tiles reads it; skip with write_ndwi_mask=False)
+    if write_ndwi_mask:
+        ndwi_mask_path = os.path.join(out_root, f"{tag}_ndwi_{ndwi_thresh:.2f}.tif")
+        write_mask_tif(ndwi_mask_path, ndwi_mask, ndwi_profile)
+        print("💾 Raw NDWI mask saved:", ndwi_mask_path)
 
     # Save the supraglacial lake mask
-    lake_mask = (ndwi_mask == 1) & (dem_float > float(elev_min))
-
     lake_mask_path = os.path.join(out_root, f"{tag}_lake_ndwi{ndwi_thresh:.2f}_dem{int(elev_min)}.tif")
-    lake_profile = {
-        "driver": "GTiff",
-        "height": dem_h, "width": dem_w, "count": 1,
-        "dtype": rasterio.uint8, "crs": dem_crs, "transform": dem_transform,
-        "nodata": 0, "compress": "deflate"
-    }
-    with rasterio.open(lake_mask_path, "w", **lake_profile) as dst:
-        dst.write(lake_mask.astype(np.uint8), 1)
+    lake_profile = {"height": dem_h, "width": dem_w, "crs": dem_crs, "transform": dem_transform}
+    write_mask_tif(lake_mask_path, lake_mask, lake_profile)
     print("💾 Supraglacial lake mask saved:", lake_mask_path)
 
     # PART 06 Polygonize into a vector
@@ -212,7 +370,9 @@ def process_safe(safe_path: str, dem_path: str, out_root: str,
         min_area_m2=min_area_m2,
         safe_name=safe_name,
         ndwi_thr=ndwi_thresh,
-        elev_min=elev_min
+        elev_min=elev_min,
+        simplify_tol=simplify_tol,
+        acq_date=date_str
     )
     if out_vec:
         print(f"✅ Vector lakes written to: {out_vec}")
@@ -232,6 +392,13 @@ def main():
     p1.add_argument("--emin", type=float, default=0.0, help="Minimum elevation (m)")
     p1.add_argument("--min-area-m2", type=float, default=1000.0, help="Min polygon area in m^2")
     p1.add_argument("--ext", choices=["gpkg","shp"], default="gpkg", help="Vector format")
+    p1.add_argument("--simplify-tol", type=float, default=None,
+                    help="Polygon simplification tolerance in CRS units (default: half a pixel, 0 = off)")
+    p1.add_argument("--no-ndwi-mask", action="store_true",
+                    help="Skip writing the raw NDWI mask GeoTIFF (make_tiles needs it)")
+    p1.add_argument("--num-threads", type=int, default=dem_utils.DEFAULT_NUM_THREADS,
+                    help="Threads for GDAL warping (default: all cores but one)")
+    p1.add_argument("--warp-mem-mb", type=int, default=512, help="GDAL warp memory limit (MB)")
 
     p2 = sub.add_parser("batch", help="Process all .SAFE under a folder (recursive)")
     p2.add_argument("--safe-root", required=True, help="Root folder containing .SAFE directories")
@@ -242,6 +409,12 @@ def main():
     p2.add_argument("--emin", type=float, default=0.0)
     p2.add_argument("--min-area-m2", type=float, default=1000.0)
     p2.add_argument("--ext", choices=["gpkg","shp"], default="gpkg")
+    p2.add_argument("--simplify-tol", type=float, default=None)
+    p2.add_argument("--no-ndwi-mask", action="store_true")
+    p2.add_argument("--num-threads", type=int, default=dem_utils.DEFAULT_NUM_THREADS)
+    p2.add_argument("--warp-mem-mb", type=int, default=512)
+    p2.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1),
+                    help="SAFE scenes processed in parallel (default: min(4, cores))")
 
     args = ap.parse_args()
 
@@ -249,7 +422,9 @@ def main():
         process_safe(
             safe_path=args.safe, dem_path=args.dem, out_root=args.out,
             ndwi_thresh=args.ndwi, elev_min=args.emin, min_area_m2=args.min_area_m2,
-            vector_ext="." + args.ext
+            vector_ext="." + args.ext, simplify_tol=args.simplify_tol,
+            write_ndwi_mask=not args.no_ndwi_mask,
+            num_threads=args.num_threads, warp_mem_mb=args.warp_mem_mb
         )
 
     elif args.cmd == "batch":
@@ -258,13 +433,42 @@ def main():
         if not paths:
             print("No .SAFE folders found. Check --safe-root or --glob.")
             return
-        for i, s in enumerate(sorted(paths), 1):
-            print(f"\n[{i}/{len(paths)}] {os.path.basename(s)}")
-            process_safe(
-                safe_path=s, dem_path=args.dem, out_root=args.out,
-                ndwi_thresh=args.ndwi, elev_min=args.emin, min_area_m2=args.min_area_m2,
-                vector_ext="." + args.ext
-            )
+        paths = sorted(paths)
+        workers = max(1, min(args.workers, len(paths)))
+        # split the thread budget so parallel scenes don't oversubscribe GDAL
+        # (warp threads and JP2 decode threads both come out of it)
+        per_worker = max(1, args.num_threads // workers)
+        run = partial(
+            process_safe, dem_path=args.dem, out_root=args.out,
+            ndwi_thresh=args.ndwi, elev_min=args.emin, min_area_m2=args.min_area_m2,
+            vector_ext="." + args.ext, simplify_tol=args.simplify_tol,
+            write_ndwi_mask=not args.no_ndwi_mask,
+            num_threads=per_worker, warp_mem_mb=args.warp_mem_mb
+        )
+
+        if workers == 1:
+            for i, s in enumerate(paths, 1):
+                print(f"\n[{i}/{len(paths)}] {os.path.basename(s)}")
+                run(s)
+            return
+
+        # warm the DEM alignment cache once per tile up front so workers only read it
+        # (tiles the DEM doesn't cover are skipped by process_safe, so not warmed)
+        first_per_tile = {}
+        for s in paths:
+            first_per_tile.setdefault(safe_id(s)[1], s)
+        for s in first_per_tile.values():
+            sentinel_bounds, dem_bounds_in_s2 = safe_and_dem_bounds(s, args.dem)
+            if not geometry_utils.bounds_overlap(dem_bounds_in_s2, sentinel_bounds):
+                continue
+            ensure_dem_alignment(s, args.dem, args.out,
+                                 num_threads=args.num_threads, warp_mem_mb=args.warp_mem_mb)
+
+        print(f"\n🚀 Processing {len(paths)} scenes on {workers} workers…")
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch_worker,
+                                 initargs=(per_worker,)) as ex:
+            for i, (s, _) in enumerate(zip(paths, ex.map(run, paths)), 1):
+                print(f"[{i}/{len(paths)}] done: {os.path.basename(s)}")
 
 if __name__ == "__main__":
     main()
@@ -3,7 +3,10 @@ File: make_tiles.py
 Purpose: Convert aligned NDWI and supraglacial lake mask rasters into
          overlapping tiles for U-Net training. Searches for matching NDWI /
          lake-mask pairs, slides a window across them, and saves each pair
-         as compressed .npz tiles under data/tiles/images and data/tiles/masks.
+         as .npy tiles (memory-mappable by LakeTileDataset) under
+         data/tiles/images and data/tiles/masks. --compressed writes the
+         older compressed .npz tiles instead; --sharded writes one stacked
+         .shard.npy per raster (plus a .ids.txt of tile ids) instead.
 """
 
 import os
@@ -12,6 +15,14 @@ import glob
 
 import numpy as np
 import rasterio
+from rasterio.windows import Window
+
+# int16 tiles store round(NDWI * NDWI_SCALE); must match dataset.NDWI_SCALE
+NDWI_SCALE = 10000
+# --ndwi-dtype choices -> stored NDWI tile dtype
+NDWI_DTYPES = {"float16": np.float16, "float32": np.float32, "int16": np.int16}
+# one stacked array per raster; must match dataset.SHARD_SUFFIX
+SHARD_SUFFIX = ".shard.npy"
 
 def find_pairs(in_dir, ndwi_suffix="_ndwi_0.25.tif",
                lake_suffix="_lake_ndwi0.25_dem0.tif"):
@@ -31,10 +42,65 @@ def find_pairs(in_dir, ndwi_suffix="_ndwi_0.25.tif",
     print(f"Found {len(pairs)} NDWI/lake pairs.")
     return pairs
 
+def iter_strips(src, tile_size, stride, dtype=None):
+    """
+    Yield (y, strip) for every row of windows, strip = rows [y, y+tile_size)
+    across the full width. Rows shared with the previous strip are kept in the
+    buffer, so each source row is read (and decompressed) once and peak
+    memory is one strip instead of the whole raster. The buffer is reused.
+    """
+    h, w = src.height, src.width
+    buf = np.empty((tile_size, w), dtype=dtype or src.dtypes[0])
+    prev_end = 0
+    for y in range(0, h - tile_size + 1, stride):
+        reuse = max(0, prev_end - y)
+        if reuse:
+            buf[:reuse] = buf[tile_size - reuse:]
+        src.read(1, window=Window(0, y + reuse, w, tile_size - reuse), out=buf[reuse:])
+        prev_end = y + tile_size
+        yield y, buf
+
+def window_lake_pixels(mask_strip, xs, tile_size):
+    """Lake-pixel count of each window along a strip, from a 1-D prefix sum of column counts."""
+    col = np.zeros(mask_strip.shape[1] + 1, dtype=np.int64)
+    np.cumsum(np.count_nonzero(mask_strip, axis=0), out=col[1:])
+    return col[xs + tile_size] - col[xs]
+
+def write_tiles(ndwi_tiles, mask_tiles, tile_ids, out_img_dir, out_mask_dir,
+                compressed=False):
+    """Write each kept window as its own .npy (or compressed .npz) image/mask pair."""
+    for ndwi_tile, mask_tile, tile_id in zip(ndwi_tiles, mask_tiles, tile_ids):
+        # add channel dimension for image: (1, H, W)
+        if compressed:
+            np.savez_compressed(os.path.join(out_img_dir, f"{tile_id}.npz"),
+                                ndwi=ndwi_tile[None, ...])
+            np.savez_compressed(os.path.join(out_mask_dir, f"{tile_id}.npz"),
+                                mask=mask_tile.astype(np.uint8))
+        else:
+            np.save(os.path.join(out_img_dir, f"{tile_id}.npy"), ndwi_tile[None, ...])
+            np.save(os.path.join(out_mask_dir, f"{tile_id}.npy"), mask_tile.astype(np.uint8))
+
+def open_shards(basename, n, tile_size, ndwi_dtype, out_img_dir, out_mask_dir):
+    """Create the (N,1,T,T) image and (N,T,T) mask .shard.npy memmaps for one raster."""
+    t = tile_size
+    imgs = np.lib.format.open_memmap(os.path.join(out_img_dir, basename + SHARD_SUFFIX),
+                                     mode="w+", dtype=ndwi_dtype, shape=(n, 1, t, t))
+    masks = np.lib.format.open_memmap(os.path.join(out_mask_dir, basename + SHARD_SUFFIX),
+                                      mode="w+", dtype=np.uint8, shape=(n, t, t))
+    return imgs, masks
+
 def tile_pair(ndwi_path, lake_path, out_img_dir, out_mask_dir,
               tile_size=256, stride=128,
-              keep_empty=False, max_empty_frac=0.2):
-    """Cut a single NDWI+mask pair into tiles and save as .npz."""
+              keep_empty=False, max_empty_frac=0.2, compressed=False,
+              ndwi_dtype="float16", sharded=False):
+    """
+    Cut a single NDWI+mask pair into tiles and save as .npy (or .npz if compressed).
+    NDWI is stored as float16 by default (ample for values in [-1, 1], half
+    the bytes of float32); ndwi_dtype="int16" stores round(NDWI * NDWI_SCALE).
+    sharded=True stacks all tiles into one memory-mapped <base>.shard.npy per
+    folder ((N,1,T,T) images, (N,T,T) masks) with tile ids in <base>.ids.txt.
+    Rasters are streamed in tile-high strips rather than read whole.
+    """
     with rasterio.open(ndwi_path) as src_img, rasterio.open(lake_path) as src_mask:
         if (src_img.width != src_mask.width or
             src_img.height != src_mask.height or
@@ -43,39 +109,66 @@ def tile_pair(ndwi_path, lake_path, out_img_dir, out_mask_dir,
             return 0
 
         h, w = src_img.height, src_img.width
-        ndwi = src_img.read(1)   # (H, W)
-        mask = src_mask.read(1)  # (H, W)
-
-    # normalize NDWI to something reasonable (-1..1)
-    ndwi_clipped = np.clip(ndwi, -1.0, 1.0).astype(np.float32)
-
-    basename = os.path.basename(ndwi_path).replace("_ndwi_0.25.tif", "")
-    count = 0
-    empty_tiles = 0
-
-    for y in range(0, h - tile_size + 1, stride):
-        for x in range(0, w - tile_size + 1, stride):
-            ndwi_tile = ndwi_clipped[y:y+tile_size, x:x+tile_size]
-            mask_tile = mask[y:y+tile_size, x:x+tile_size]
+        ys = np.arange(0, h - tile_size + 1, stride)
+        xs = np.arange(0, w - tile_size + 1, stride)
+        if ys.size == 0 or xs.size == 0:
+            print(f"⚠️ Raster smaller than one tile, skipping: {ndwi_path}")
+            return 0
 
-            if ndwi_tile.shape != (tile_size, tile_size):
+        basename = os.path.basename(ndwi_path).replace("_ndwi_0.25.tif", "")
+
+        # pass 1 (mask only): which windows of each strip to keep (empty = no lake pixels)
+        keep_x = []
+        empty_tiles = 0
+        for _, mask_strip in iter_strips(src_mask, tile_size, stride):
+            lake_px = window_lake_pixels(mask_strip, xs, tile_size)
+            empty_tiles += int(np.count_nonzero(lake_px == 0))
+            keep_x.append(np.arange(xs.size) if keep_empty else np.flatnonzero(lake_px))
+        count = sum(k.size for k in keep_x)
+
+        # pass 2: cut and write the kept windows strip by strip
+        out_dtype = NDWI_DTYPES[ndwi_dtype]
+        if sharded and count:
+            imgs, masks = open_shards(basename, count, tile_size, out_dtype,
+                                      out_img_dir, out_mask_dir)
+        tile_ids = []
+        k = 0
+        strips = zip(iter_strips(src_img, tile_size, stride, dtype=np.float32),
+                     iter_strips(src_mask, tile_size, stride), keep_x)
+        for (y, ndwi_strip), (_, mask_strip), kx in strips:
+            if kx.size == 0:
                 continue
 
-            # Decide whether to keep empty tiles
-            if mask_tile.sum() == 0:
-                empty_tiles += 1
-                if not keep_empty:
-                    continue
-
-            tile_id = f"{basename}_y{y}_x{x}"
-            img_out = os.path.join(out_img_dir, f"{tile_id}.npz")
-            mask_out = os.path.join(out_mask_dir, f"{tile_id}.npz")
-
-            # add channel dimension for image: (1, H, W)
-            np.savez_compressed(img_out, ndwi=ndwi_tile[None, ...])
-            np.savez_compressed(mask_out, mask=mask_tile.astype(np.uint8))
-
-            count += 1
+            # normalize NDWI to something reasonable (-1..1)
+            ndwi_clipped = np.clip(ndwi_strip, -1.0, 1.0)
+            if out_dtype == np.int16:
+                ndwi_clipped = np.rint(ndwi_clipped * NDWI_SCALE).astype(np.int16)
+            else:
+                ndwi_clipped = ndwi_clipped.astype(out_dtype, copy=False)
+
+            # (nx, T, T) views of the strip's windows -> copies of the kept ones
+            ndwi_tiles = np.lib.stride_tricks.sliding_window_view(
+                ndwi_clipped, (tile_size, tile_size))[0, ::stride][kx]
+            mask_tiles = np.lib.stride_tricks.sliding_window_view(
+                mask_strip, (tile_size, tile_size))[0, ::stride][kx]
+            strip_ids = [f"{basename}_y{y}_x{x}" for x in xs[kx].tolist()]
+
+            if sharded:
+                imgs[k:k + kx.size, 0] = ndwi_tiles
+                masks[k:k + kx.size] = mask_tiles
+            else:
+                write_tiles(ndwi_tiles, mask_tiles, strip_ids,
+                            out_img_dir, out_mask_dir, compressed=compressed)
+            tile_ids.extend(strip_ids)
+            k += kx.size
+
+    if sharded and count:
+        imgs.flush()
+        masks.flush()
+        del imgs, masks
+        # row k of both shards is tile id line k
+        with open(os.path.join(out_img_dir, f"{basename}.ids.txt"), "w") as f:
+            f.writelines(f"{tile_id}\n" for tile_id in tile_ids)
 
     print(f"🧩 Tiled {basename}: {count} tiles (empty tiles seen: {empty_tiles})")
     return count
@@ -88,6 +181,13 @@ def main():
     ap.add_argument("--stride", type=int, default=128)
     ap.add_argument("--keep-empty", action="store_true",
                     help="Keep tiles with no lake pixels (mask sum == 0)")
+    ap.add_argument("--compressed", action="store_true",
+                    help="Write compressed .npz tiles instead of memory-mappable .npy")
+    ap.add_argument("--ndwi-dtype", choices=list(NDWI_DTYPES), default="float16",
+                    help="Storage dtype for NDWI tiles (int16 = NDWI x 10000; "
+                         "float16/int16 are half the bytes of float32)")
+    ap.add_argument("--sharded", action="store_true",
+                    help="Write one stacked .shard.npy per raster instead of one file per tile")
     args = ap.parse_args()
 
     in_dir = args.in_dir
@@ -105,7 +205,10 @@ def main():
             out_img_dir, out_mask_dir,
             tile_size=args.tile_size,
             stride=args.stride,
-            keep_empty=args.keep_empty
+            keep_empty=args.keep_empty,
+            compressed=args.compressed,
+            ndwi_dtype=args.ndwi_dtype,
+            sharded=args.sharded
         )
 
     print(f"\n✅ Done. Total tiles written: {total_tiles}")
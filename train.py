@@ -6,21 +6,42 @@ Purpose: Train a small U-Net segmentation model on NDWI + lake-mask tiles.
          to unet_lakes.pth.
 """
 
+import argparse
+import os
+
 import torch
 import torch.nn as nn
 from torch.utils.data import DataLoader, random_split
 
-from dataset import LakeTileDataset
-from unet import UNetSmall
+from dataset import LakeTileDataset, dequantize_ndwi
+from unet import ARCH_FLAGS, build_model, save_arch
+
+
+def parse_args():
+    ap = argparse.ArgumentParser(description="Train the small U-Net on NDWI lake tiles")
+    # layout flags; saved to unet_lakes.arch.json so the model can be rebuilt when loading
+    ap.add_argument("--separable", action="store_true",
+                    help="Depthwise-separable convs in the deeper blocks")
+    ap.add_argument("--pixel-shuffle", action="store_true",
+                    help="PixelShuffle upsampling instead of ConvTranspose2d")
+    ap.add_argument("--additive-skips", action="store_true",
+                    help="Add skip connections instead of concatenating them")
+    return ap.parse_args()
 
 
 def main():
+    args = parse_args()
+    arch = {k: getattr(args, k) for k in ARCH_FLAGS}
+
     # 1) Device
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     print("Using device:", device)
+    # fixed 256x256 inputs: let cuDNN benchmark and keep the fastest conv algorithms
+    torch.backends.cudnn.benchmark = True
 
     # 2) Dataset & split (optional: train/val)
-    full_dataset = LakeTileDataset("data/tiles/images", "data/tiles/masks")
+    # int16/float16 tiles stay 16-bit until they are on the device (see dequantize_ndwi)
+    full_dataset = LakeTileDataset("data/tiles/images", "data/tiles/masks", dequantize=False)
     print("Total tiles:", len(full_dataset))
 
     # simple 90/10 split
@@ -31,46 +52,73 @@ def main():
     print("Train tiles:", len(train_dataset))
     print("Val tiles:  ", len(val_dataset))
 
-    train_loader = DataLoader(train_dataset, batch_size=8, shuffle=True)
-    val_loader = DataLoader(val_dataset, batch_size=8, shuffle=False)
+    # pinned host batches allow async (non_blocking) copies to the GPU;
+    # worker processes keep tile loading off the training loop
+    pin_memory = device.type == "cuda"
+    loader_kw = dict(batch_size=8, pin_memory=pin_memory,
+                     num_workers=min(8, os.cpu_count() or 1),
+                     persistent_workers=True, prefetch_factor=4)
+    # drop_last keeps every training batch the same shape for the compiled graph
+    train_loader = DataLoader(train_dataset, shuffle=True, drop_last=True, **loader_kw)
+    val_loader = DataLoader(val_dataset, shuffle=False, **loader_kw)
 
     # 3) Model, loss, optimizer
-    model = UNetSmall(in_channels=1, out_channels=1).to(device)
+    # channels_last (NHWC) is the faster conv layout on tensor-core GPUs
+    model = build_model(arch).to(device, memory_format=torch.channels_last)
+    print("Architecture:", arch)
     criterion = nn.BCEWithLogitsLoss()
     optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
 
+    # compiled forward for speed; `model` itself is kept for saving clean state_dict keys
+    net = model
+    if hasattr(torch, "compile"):
+        mode = "max-autotune" if device.type == "cuda" else "reduce-overhead"
+        net = torch.compile(model, mode=mode, dynamic=False)
+
+    # mixed precision (fp16 autocast + loss scaling) on CUDA; plain fp32 on CPU
+    use_amp = device.type == "cuda"
+    scaler = torch.amp.GradScaler("cuda", enabled=use_amp)
+
     num_epochs = 3  # start small just to see it move
 
     for epoch in range(1, num_epochs + 1):
         model.train()
-        running_loss = 0.0
+        # summed on the device; one .item() per epoch instead of a sync per step
+        running_loss = torch.zeros((), device=device)
+        n_train = 0
 
         for imgs, masks in train_loader:
-            imgs = imgs.to(device)          # (B,1,256,256)
-            masks = masks.to(device)        # (B,1,256,256)
+            imgs = dequantize_ndwi(imgs.to(device, memory_format=torch.channels_last,
+                                           non_blocking=True))  # (B,1,256,256)
+            masks = masks.to(device, non_blocking=True)  # (B,1,256,256)
 
             optimizer.zero_grad()
-            logits = model(imgs)            # (B,1,256,256)
-            loss = criterion(logits, masks)
-            loss.backward()
-            optimizer.step()
+            with torch.autocast(device_type=device.type, dtype=torch.float16, enabled=use_amp):
+                logits = net(imgs)              # (B,1,256,256)
+                loss = criterion(logits, masks)
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
 
-            running_loss += loss.item() * imgs.size(0)
+            running_loss += loss.detach() * imgs.size(0)
+            n_train += imgs.size(0)
 
-        avg_train_loss = running_loss / len(train_dataset)
+        avg_train_loss = running_loss.item() / max(1, n_train)
 
         # quick val loss
         model.eval()
-        val_loss = 0.0
-        with torch.no_grad():
+        val_loss = torch.zeros((), device=device)
+        with torch.inference_mode():
             for imgs, masks in val_loader:
-                imgs = imgs.to(device)
-                masks = masks.to(device)
-                logits = model(imgs)
-                loss = criterion(logits, masks)
-                val_loss += loss.item() * imgs.size(0)
+                imgs = dequantize_ndwi(imgs.to(device, memory_format=torch.channels_last,
+                                               non_blocking=True))
+                masks = masks.to(device, non_blocking=True)
+                with torch.autocast(device_type=device.type, dtype=torch.float16, enabled=use_amp):
+                    logits = net(imgs)
+                    loss = criterion(logits, masks)
+                val_loss += loss * imgs.size(0)
 
-        avg_val_loss = val_loss / len(val_dataset)
+        avg_val_loss = val_loss.item() / len(val_dataset)
 
         print(
             f"Epoch {epoch}/{num_epochs} "
@@ -78,9 +126,10 @@ def main():
             f"- val loss: {avg_val_loss:.4f}"
         )
 
-    # 4) Save model weights
+    # 4) Save model weights (plain state_dict) and the layout flags next to them
     torch.save(model.state_dict(), "unet_lakes.pth")
-    print("✅ Training complete, model saved to unet_lakes.pth")
+    save_arch("unet_lakes.pth", arch)
+    print("✅ Training complete, model saved to unet_lakes.pth (+ unet_lakes.arch.json)")
 
 
 if __name__ == "__main__":
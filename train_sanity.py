@@ -6,19 +6,25 @@ Purpose: Lightweight sanity check for the tiling and model setup. Loads a
          that training can proceed without errors.
 """
 
+import os
+
 import torch
 import torch.nn as nn
 from torch.utils.data import DataLoader
 
 from dataset import LakeTileDataset
-from unet import UNetSmall
+from unet import build_model
 
 
 def main():
 
     print("Loading dataset...")
     dataset = LakeTileDataset("data/tiles/images", "data/tiles/masks")
-    loader = DataLoader(dataset, batch_size=4, shuffle=True)
+    # same loader setup as train.py: tile loading runs in worker processes
+    loader = DataLoader(dataset, batch_size=4, shuffle=True,
+                        num_workers=min(8, os.cpu_count() or 1),
+                        pin_memory=torch.cuda.is_available(),
+                        persistent_workers=True, prefetch_factor=4)
 
     print("Dataset size:", len(dataset))
 
@@ -27,11 +33,16 @@ def main():
     print("Batch shapes:", imgs.shape, masks.shape)
 
     # Create model
-    model = UNetSmall(in_channels=1, out_channels=1)
+    model = build_model()
     print("Model created!")
 
+    # Same compiled forward as train.py, so compile problems show up here first
+    net = model
+    if hasattr(torch, "compile"):
+        net = torch.compile(model, mode="reduce-overhead", dynamic=False)
+
     # Forward pass
-    logits = model(imgs)  # output shape (B,1,256,256)
+    logits = net(imgs)  # output shape (B,1,256,256)
     print("Logits shape:", logits.shape)
 
     # Loss
@@ -5,21 +5,50 @@ Purpose: Define a compact U-Net architecture (encoder–decoder with skip
          tiles. Used by train.py and visualization scripts.
 """
 
+import json
+import os
+
 import torch
 import torch.nn as nn
 
+# UNetSmall layout flags; saved next to a checkpoint so it can be rebuilt
+ARCH_FLAGS = ("separable", "pixel_shuffle", "additive_skips")
+
+
+class SepConv2d(nn.Module):
+    """
+    Depthwise-separable 3x3 conv: per-channel 3x3 (groups=in) -> 1x1 pointwise.
+    Same receptive field as a dense 3x3 at a fraction of the params/FLOPs.
+    """
+    def __init__(self, in_channels: int, out_channels: int):
+        super().__init__()
+        self.depthwise = nn.Conv2d(in_channels, in_channels, kernel_size=3,
+                                   padding=1, groups=in_channels)
+        self.pointwise = nn.Conv2d(in_channels, out_channels, kernel_size=1)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.pointwise(self.depthwise(x))
+
 
 class DoubleConv(nn.Module):
     """
     (Conv2d -> ReLU -> Conv2d -> ReLU)
     Keeps spatial size, changes channels.
+    separable=True swaps both 3x3 convs for SepConv2d (not compatible with
+    checkpoints trained with dense convs).
     """
-    def __init__(self, in_channels: int, out_channels: int):
+    def __init__(self, in_channels: int, out_channels: int, separable: bool = False):
         super().__init__()
+        if separable:
+            conv1 = SepConv2d(in_channels, out_channels)
+            conv2 = SepConv2d(out_channels, out_channels)
+        else:
+            conv1 = nn.Conv2d(in_channels, out_channels, kernel_size=3, padding=1)
+            conv2 = nn.Conv2d(out_channels, out_channels, kernel_size=3, padding=1)
         self.block = nn.Sequential(
-            nn.Conv2d(in_channels, out_channels, kernel_size=3, padding=1),
+            conv1,
             nn.ReLU(inplace=True),
-            nn.Conv2d(out_channels, out_channels, kernel_size=3, padding=1),
+            conv2,
             nn.ReLU(inplace=True),
         )
 
@@ -27,36 +56,65 @@ class DoubleConv(nn.Module):
         return self.block(x)
 
 
+def upsample2x(in_channels: int, out_channels: int, pixel_shuffle: bool = False) -> nn.Module:
+    """
+    2x spatial upsample. Default is ConvTranspose2d(k=2, s=2); pixel_shuffle=True
+    uses a 1x1 conv to out*4 channels + PixelShuffle(2) instead (no checkerboard
+    artifacts, not compatible with checkpoints trained with ConvTranspose2d).
+    """
+    if pixel_shuffle:
+        return nn.Sequential(
+            nn.Conv2d(in_channels, out_channels * 4, kernel_size=1),
+            nn.PixelShuffle(2),
+        )
+    return nn.ConvTranspose2d(in_channels, out_channels, kernel_size=2, stride=2)
+
+
 class UNetSmall(nn.Module):
-    def __init__(self, in_channels: int = 1, out_channels: int = 1):
+    def __init__(self, in_channels: int = 1, out_channels: int = 1, separable: bool = False,
+                 pixel_shuffle: bool = False, additive_skips: bool = False):
+        """
+        separable / pixel_shuffle / additive_skips change the layer layout, so
+        keep them False to load checkpoints trained with the original U-Net.
+        additive_skips=True adds each skip to the upsampled tensor (x + skip)
+        instead of concatenating it, halving the decoder input channels and
+        avoiding a 2C x H x W concat buffer per level.
+        """
         super().__init__()
+        self.additive_skips = additive_skips
+        merge = 1 if additive_skips else 2   # decoder input channels = merge x skip channels
 
-        # Encoder
+        # Encoder (down1 stays dense: too few input channels to gain from separating)
         self.down1 = DoubleConv(in_channels, 32)
         self.pool1 = nn.MaxPool2d(2)   # 256 -> 128
 
-        self.down2 = DoubleConv(32, 64)
+        self.down2 = DoubleConv(32, 64, separable=separable)
         self.pool2 = nn.MaxPool2d(2)   # 128 -> 64
 
-        self.down3 = DoubleConv(64, 128)
+        self.down3 = DoubleConv(64, 128, separable=separable)
         self.pool3 = nn.MaxPool2d(2)   # 64 -> 32
 
         # Bottleneck
-        self.bottleneck = DoubleConv(128, 256)
+        self.bottleneck = DoubleConv(128, 256, separable=separable)
 
         # Decoder
-        self.up3 = nn.ConvTranspose2d(256, 128, kernel_size=2, stride=2)  # 32 -> 64
-        self.dec3 = DoubleConv(256, 128)  # 128 (up) + 128 (skip)
+        self.up3 = upsample2x(256, 128, pixel_shuffle)  # 32 -> 64
+        self.dec3 = DoubleConv(128 * merge, 128, separable=separable)  # 128 (up) + 128 (skip)
 
-        self.up2 = nn.ConvTranspose2d(128, 64, kernel_size=2, stride=2)   # 64 -> 128
-        self.dec2 = DoubleConv(128, 64)   # 64 (up) + 64 (skip)
+        self.up2 = upsample2x(128, 64, pixel_shuffle)   # 64 -> 128
+        self.dec2 = DoubleConv(64 * merge, 64, separable=separable)    # 64 (up) + 64 (skip)
 
-        self.up1 = nn.ConvTranspose2d(64, 32, kernel_size=2, stride=2)    # 128 -> 256
-        self.dec1 = DoubleConv(64, 32)    # 32 (up) + 32 (skip)
+        self.up1 = upsample2x(64, 32, pixel_shuffle)    # 128 -> 256
+        self.dec1 = DoubleConv(32 * merge, 32, separable=separable)    # 32 (up) + 32 (skip)
 
         # Final 1×1 conv → 1 channel (lake vs not-lake)
         self.final_conv = nn.Conv2d(32, out_channels, kernel_size=1)
 
+    def _merge(self, x: torch.Tensor, skip: torch.Tensor) -> torch.Tensor:
+        if self.additive_skips:
+            return x + skip
+        return torch.cat([x, skip], dim=1)   # concat along channel axis
+
     def forward(self, x: torch.Tensor) -> torch.Tensor:
         # Encoder
         x1 = self.down1(x)
@@ -73,16 +131,40 @@ class UNetSmall(nn.Module):
 
         # Decoder with skip connections
         x = self.up3(x_bottleneck)
-        x = torch.cat([x, x5], dim=1)   # concat along channel axis
+        x = self._merge(x, x5)
         x = self.dec3(x)
 
         x = self.up2(x)
-        x = torch.cat([x, x3], dim=1)
+        x = self._merge(x, x3)
         x = self.dec2(x)
 
         x = self.up1(x)
-        x = torch.cat([x, x1], dim=1)
+        x = self._merge(x, x1)
         x = self.dec1(x)
 
         logits = self.final_conv(x)     # (B, 1, H, W)
         return logits
+
+
+def arch_path(ckpt: str) -> str:
+    """Sidecar JSON holding the layout flags of a checkpoint (unet_lakes.pth -> unet_lakes.arch.json)."""
+    return os.path.splitext(ckpt)[0] + ".arch.json"
+
+
+def save_arch(ckpt: str, arch: dict) -> None:
+    with open(arch_path(ckpt), "w") as f:
+        json.dump({k: bool(arch.get(k, False)) for k in ARCH_FLAGS}, f)
+
+
+def load_arch(ckpt: str) -> dict:
+    """Layout flags saved with ckpt; {} (the original U-Net) when there is no sidecar."""
+    path = arch_path(ckpt)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return {k: bool(v) for k, v in json.load(f).items() if k in ARCH_FLAGS}
+
+
+def build_model(arch: dict = None) -> UNetSmall:
+    """UNetSmall for 1-channel NDWI in / 1-channel logits out with the given layout flags."""
+    return UNetSmall(in_channels=1, out_channels=1, **(arch or {}))
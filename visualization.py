@@ -5,26 +5,88 @@ Purpose: Load a trained U-Net model and sample NDWI tiles to produce
          probability maps, and thresholded overlays for visual inspection.
 """
 
+import os
+
 import torch
+from torch.utils.data import DataLoader, Subset
+import matplotlib
+matplotlib.use("Agg")   # non-interactive: figures are written to PNG, no GUI event loop
 import matplotlib.pyplot as plt
 
 from dataset import LakeTileDataset
-from unet import UNetSmall
+from unet import build_model, load_arch, save_arch
+
+# written by export_fp16_checkpoint(); used instead of unet_lakes.pth when present
+# (and re-exported first if unet_lakes.pth is newer)
+FP16_CHECKPOINT = "unet_lakes.fp16.pth"
+
+def load_state_dict(path, device):
+    """
+    Load a checkpoint memory-mapped and weights-only (tensors are paged in
+    as they are copied to the device); falls back to a plain torch.load on
+    PyTorch < 2.1, which has no mmap argument.
+    """
+    try:
+        return torch.load(path, map_location=device, mmap=True, weights_only=True)
+    except TypeError:
+        return torch.load(path, map_location=device)
+
+def export_fp16_checkpoint(src="unet_lakes.pth", dst=FP16_CHECKPOINT):
+    """One-time conversion of the fp32 checkpoint to fp16 (half the bytes to load)."""
+    state_dict = load_state_dict(src, "cpu")
+    torch.save({k: v.half() if v.is_floating_point() else v for k, v in state_dict.items()}, dst)
+    save_arch(dst, load_arch(src))   # same layout flags as the fp32 weights
+    print(f"Saved fp16 checkpoint to {dst}")
+    return dst
+
+def export_onnx(dst="unet.onnx", ckpt="unet_lakes.pth", batch_size=4, tile_size=256):
+    """
+    Export the U-Net (layout flags from ckpt's .arch.json) to ONNX with a static
+    (batch_size, 1, tile_size, tile_size) input named "input", e.g. for building an INT8 TensorRT engine with
+    trtexec --onnx=unet.onnx --int8 --calib=calib.cache --shapes=input:4x1x256x256
+    """
+    model = build_model(load_arch(ckpt))
+    model.load_state_dict(load_state_dict(ckpt, "cpu"))
+    model.eval()
+    dummy = torch.zeros(batch_size, 1, tile_size, tile_size)
+    torch.onnx.export(model, dummy, dst, opset_version=17,
+                      input_names=["input"], output_names=["logits"])
+    print(f"Exported ONNX model to {dst}")
+    return dst
 
-def visualize_samples(indices=None, threshold=0.5, num_samples=4):
+def visualize_samples(indices=None, threshold=0.5, num_samples=4, out_dir="viz"):
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
     print("Using device:", device)
+    # every tile is the same size: let cuDNN benchmark and keep the fastest conv algorithms
+    torch.backends.cudnn.benchmark = True
+    torch.backends.cudnn.deterministic = False
 
     # 1) Load dataset
     dataset = LakeTileDataset("data/tiles/images", "data/tiles/masks")
     print("Dataset size:", len(dataset))
 
     # 2) Load trained model
-    model = UNetSmall(in_channels=1, out_channels=1).to(device)
-    state_dict = torch.load("unet_lakes.pth", map_location=device)
+    ckpt = "unet_lakes.pth"
+    if os.path.exists(FP16_CHECKPOINT):
+        # re-export when training has rewritten the fp32 weights since the last export
+        if os.path.exists(ckpt) and os.path.getmtime(FP16_CHECKPOINT) < os.path.getmtime(ckpt):
+            export_fp16_checkpoint(ckpt, FP16_CHECKPOINT)
+        ckpt = FP16_CHECKPOINT
+    # same layout flags the checkpoint was trained with;
+    # channels_last (NHWC) is the faster conv layout on tensor-core GPUs
+    model = build_model(load_arch(ckpt)).to(device, memory_format=torch.channels_last)
+    state_dict = load_state_dict(ckpt, device)
+    if ckpt == FP16_CHECKPOINT and device.type == "cuda":
+        model.half()   # keep the fp16 weights as-is; on CPU they are upcast on load
     model.load_state_dict(state_dict)
     model.eval()
-    print("Loaded model from unet_lakes.pth")
+    print(f"Loaded model from {ckpt}")
+
+    # compiled forward (fused kernels, fewer launches; "reduce-overhead" also
+    # captures and replays CUDA graphs on GPU); `model` stays the plain module
+    net = model
+    if hasattr(torch, "compile"):
+        net = torch.compile(model, mode="reduce-overhead", fullgraph=True)
 
     # 3) Choose some indices to visualize
     if indices is None:
@@ -34,42 +96,70 @@ def visualize_samples(indices=None, threshold=0.5, num_samples=4):
 
     print("Visualizing indices:", indices)
 
-    for idx in indices:
-        img, mask = dataset[idx]      # img: (1,H,W), mask: (1,H,W)
-        img_batch = img.unsqueeze(0).to(device)  # (1,1,H,W)
-
-        with torch.no_grad():
-            logits = model(img_batch)          # (1,1,H,W)
-            probs = torch.sigmoid(logits)[0, 0].cpu().numpy()  # (H,W)
-
-        ndwi = img[0].numpy()                  # (H,W)
-        true_mask = mask[0].numpy()            # (H,W)
-        pred_binary = (probs > threshold).astype(float)
-
-        # 4) Plot
-        fig, axes = plt.subplots(1, 4, figsize=(14, 4))
-        fig.suptitle(f"Tile index {idx}", fontsize=14)
-
-        axes[0].imshow(ndwi, cmap="gray")
-        axes[0].set_title("NDWI tile")
-        axes[0].axis("off")
-
-        axes[1].imshow(true_mask, cmap="gray")
-        axes[1].set_title("True mask")
-        axes[1].axis("off")
-
-        im2 = axes[2].imshow(probs, cmap="viridis", vmin=0, vmax=1)
-        axes[2].set_title("Predicted prob")
-        axes[2].axis("off")
-        fig.colorbar(im2, ax=axes[2], fraction=0.046, pad=0.04)
-
-        axes[3].imshow(ndwi, cmap="gray")
-        axes[3].imshow(pred_binary, alpha=0.4)
-        axes[3].set_title(f"Pred > {threshold}")
-        axes[3].axis("off")
-
-        plt.tight_layout()
-        plt.show()
+    # one batched forward pass for all selected tiles; loop only to plot.
+    # tiles are read by worker processes and collated into pinned host memory
+    # so the H2D copy can run async
+    loader = DataLoader(Subset(dataset, indices), batch_size=len(indices),
+                        num_workers=min(4, len(indices)),
+                        pin_memory=device.type == "cuda")
+    batch_cpu, masks_cpu = next(iter(loader))  # (N,1,H,W) each
+    batch = batch_cpu.to(device, memory_format=torch.channels_last,
+                         non_blocking=True)  # (N,1,H,W)
+
+    # fp16 autocast on CUDA (tensor cores, half the bandwidth); fp32 on CPU
+    with torch.inference_mode(), torch.autocast(device_type=device.type, dtype=torch.float16,
+                                                enabled=device.type == "cuda"):
+        if net is not model:
+            net(torch.zeros_like(batch))       # warmup: compile for this batch shape
+        logits = net(batch)                    # (N,1,H,W)
+        # sigmoid + threshold on the device; one D2H copy each for the whole batch
+        probs_gpu = torch.sigmoid(logits.float())[:, 0]        # (N,H,W)
+        bin_gpu = (probs_gpu > threshold).to(torch.uint8)
+    probs_all = probs_gpu.cpu().numpy()        # (N,H,W)
+    bin_all = bin_gpu.cpu().numpy()            # (N,H,W) uint8
+    # NDWI from the host copy of the batch (no extra D2H), masks stacked once
+    ndwi_all = batch_cpu.numpy()[:, 0]         # (N,H,W)
+    mask_all = masks_cpu.numpy()[:, 0]
+
+    # 4) Plot: one figure whose image artists are created once and updated per tile,
+    #    saved as out_dir/viz_<idx>.png
+    os.makedirs(out_dir, exist_ok=True)
+    fig, axes = plt.subplots(1, 4, figsize=(14, 4))
+
+    im_ndwi = axes[0].imshow(ndwi_all[0], cmap="gray")
+    axes[0].set_title("NDWI tile")
+
+    im_true = axes[1].imshow(mask_all[0], cmap="gray")
+    axes[1].set_title("True mask")
+
+    im_prob = axes[2].imshow(probs_all[0], cmap="viridis", vmin=0, vmax=1)
+    axes[2].set_title("Predicted prob")
+    fig.colorbar(im_prob, ax=axes[2], fraction=0.046, pad=0.04)
+
+    im_base = axes[3].imshow(ndwi_all[0], cmap="gray")
+    im_pred = axes[3].imshow(bin_all[0], alpha=0.4)
+    axes[3].set_title(f"Pred > {threshold}")
+
+    for ax in axes:
+        ax.axis("off")
+
+    # title, colorbar and layout are set up once; per tile only the text changes
+    title = fig.suptitle(f"Tile index {indices[0]}", fontsize=14)
+    plt.tight_layout()
+
+    for k, idx in enumerate(indices):
+        title.set_text(f"Tile index {idx}")
+        for im, data in ((im_ndwi, ndwi_all[k]), (im_true, mask_all[k]),
+                         (im_base, ndwi_all[k]), (im_pred, bin_all[k])):
+            im.set_data(data)
+            im.autoscale()   # per-tile color range, as a fresh imshow would pick
+        im_prob.set_data(probs_all[k])   # fixed 0..1 range
+
+        out_path = os.path.join(out_dir, f"viz_{idx}.png")
+        fig.savefig(out_path, dpi=100)
+        print("Saved", out_path)
+
+    plt.close(fig)
 
 
 if __name__ == "__main__":